@@ -1,17 +1,40 @@
 #!/usr/bin/python3
 
 from argparse import ArgumentParser
+import asyncio
+import csv as csvlib
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from contextlib import contextmanager
+import itertools
+import http.client
+import json
+import math
+import multiprocessing
+import numpy as np
 import os
+import queue
+import random
+import shlex
 import shutil
 import signal
+import socket
 import sys
 from subprocess import (check_output, STDOUT, CalledProcessError,
-                        Popen, call)
+                        Popen, PIPE, call)
 import sqlite3
+import struct
 import tabulate
-from tempfile import mkdtemp
+from tempfile import mkdtemp, TemporaryFile
+import threading
 import time
 import traceback
+import zipfile
+import zlib
+
+try:
+    import tomllib
+except ImportError:
+    tomllib = None
 
 if "GOPATH" not in os.environ:
     print("Please set GOPATH.")
@@ -33,13 +56,54 @@ def handle_sigusr1(signum, frame):
     sigusr_received = True
 
 
-def get_free_mem(include_cached=False):
-    fmt = "$4"
-    if include_cached:
-        fmt += "+$7"
-    free = check_output("free -m | awk '/Mem:/ { print " + fmt + "  }'",
-                        shell=True)
-    return int(free.decode())
+# trace spans not yet written to the db, appended to from any thread
+spans = []
+spans_lock = threading.Lock()
+# categories of the spans recorded once per command, probe or sample.
+# --no-recs leaves them out along with the recs, so a trace of such a run
+# only shows batches, backend setup and db writes.
+PER_OP_CATS = ('op', 'process', 'http', 'lxd', 'prober', 'ready',
+               'sampler')
+trace_per_op = True
+
+
+def add_span(name, cat, start, end, thread=None, **args):
+    if not trace_per_op and cat in PER_OP_CATS:
+        return
+    if thread is None:
+        thread = threading.current_thread().name
+    with spans_lock:
+        spans.append((name, cat, thread, start, end - start,
+                      json.dumps(args) if args else None))
+
+
+@contextmanager
+def span(name, cat, **args):
+    start = time.time()
+    try:
+        yield
+    finally:
+        add_span(name, cat, start, time.time(), **args)
+
+
+# write out the spans collected so far; the caller commits
+def save_spans(backend):
+    global spans
+    with spans_lock:
+        pending, spans = spans, []
+    dbc.executemany("INSERT INTO spans(run_id, backend, name, cat, thread, "
+                    "start, dur, args) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    [(run_id, backend) + sp for sp in pending])
+
+
+# returns /proc/meminfo as a dict of kB values
+def read_meminfo():
+    info = {}
+    with open('/proc/meminfo', 'r') as meminfof:
+        for line in meminfof:
+            key, val = line.split(':', 1)
+            info[key] = int(val.split()[0])
+    return info
 
 
 def get_load():
@@ -48,434 +112,2530 @@ def get_load():
     return float(loadavg)
 
 
-def get_disk_usage():
-    avail = check_output('df -BM --output=avail,target | grep " \/$"',
-                         shell=True)
-    return int(avail.decode().split()[0][:-1])
+# returns (total, idle) jiffies summed over all cpus
+def read_cpu_times():
+    with open('/proc/stat', 'r') as statf:
+        fields = [int(f) for f in statf.readline().split()[1:]]
+    return sum(fields), fields[3] + fields[4]
+
+
+def get_disk_avail(path='/'):
+    st = os.statvfs(path)
+    return st.f_bavail * st.f_frsize // 2 ** 20
+
 
+CLK_TCK = os.sysconf('SC_CLK_TCK')
+PAGE_KB = os.sysconf('SC_PAGE_SIZE') // 1024
 
-def import_image(image):
+
+# returns dict(rss=kB, cpu_time=sec, threads=n, fds=n) for a pid, or None
+# if it went away. fds is None when we may not look at the fd table.
+def read_proc_stats(pid):
+    try:
+        with open('/proc/{}/stat'.format(pid), 'r') as statf:
+            data = statf.read()
+    except (FileNotFoundError, ProcessLookupError):
+        return None
+    # comm may contain spaces, so split after its closing paren
+    fields = data[data.rindex(')') + 2:].split()
+    try:
+        fds = len(os.listdir('/proc/{}/fd'.format(pid)))
+    except PermissionError:
+        fds = None
+    except FileNotFoundError:
+        return None
+    return dict(rss=int(fields[21]) * PAGE_KB,
+                cpu_time=(int(fields[11]) + int(fields[12])) / CLK_TCK,
+                threads=int(fields[17]),
+                fds=fds)
+
+
+def read_cmdline(pid):
+    try:
+        with open('/proc/{}/cmdline'.format(pid), 'rb') as cmdf:
+            return cmdf.read().replace(b'\0', b' ').decode(errors='replace')
+    except (FileNotFoundError, ProcessLookupError):
+        return ''
+
+
+def find_child_pid(ppid):
+    for pid in os.listdir('/proc'):
+        if not pid.isdigit():
+            continue
+        try:
+            with open('/proc/{}/stat'.format(pid), 'r') as statf:
+                data = statf.read()
+        except (FileNotFoundError, ProcessLookupError):
+            continue
+        if int(data[data.rindex(')') + 2:].split()[1]) == ppid:
+            return int(pid)
+    return None
+
+
+# find lxc-monitord and '[lxc monitor]' processes belonging to lxd_dir.
+# 'seen' maps pids already looked at to their role, or None for any other
+# process, and is updated in place: passing the same dict to every call
+# only reads the cmdline of processes started since the last one, which
+# at high density are few next to all the containers' processes.
+def find_lxc_helpers(lxd_dir, seen=None):
+    if seen is None:
+        seen = {}
+    pids = set(int(pid) for pid in os.listdir('/proc') if pid.isdigit())
+    for pid in set(seen) - pids:
+        del seen[pid]
+    for pid in pids - set(seen):
+        cmdline = read_cmdline(pid)
+        seen[pid] = None
+        if lxd_dir not in cmdline:
+            continue
+        if cmdline.startswith('[lxc monitor]'):
+            seen[pid] = 'lxc-monitor'
+        elif 'lxc-monitord' in cmdline:
+            seen[pid] = 'lxc-monitord'
+    return sorted((role, pid) for pid, role in seen.items() if role)
+
+
+class ResourceSampler(threading.Thread):
+    """Samples host memory, load, cpu and disk at a fixed interval.
+
+    Reads /proc and statvfs directly rather than spawning free/df, keeps
+    the whole series for the batch and exposes the newest sample so the
+    stop conditions in do_cmds don't have to measure anything themselves.
+
+    Given the lxd pid, each sample also records RSS, cpu time, threads and
+    open fds of the daemon and of the lxc monitor processes under lxd_dir.
+    """
+
+    def __init__(self, interval, lxd_pid=None, lxd_dir=None):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.lxd_pid = lxd_pid
+        self.lxd_dir = lxd_dir
+        # pid -> helper role, see find_lxc_helpers
+        self.seen_pids = {}
+        self.samples = []
+        self.start_time = time.time()
+        self.stopped = threading.Event()
+        self.last_cpu = read_cpu_times()
+        self.latest = self.sample()
+
+    def sample(self):
+        start = time.time()
+        mem = read_meminfo()
+        total, idle = read_cpu_times()
+        dtotal = total - self.last_cpu[0]
+        cpu_busy = 1 - (idle - self.last_cpu[1]) / dtotal if dtotal else 0.0
+        self.last_cpu = (total, idle)
+        s = dict(t=time.time() - self.start_time,
+                 mem_free=mem['MemFree'] // 1024,
+                 mem_cached=(mem['Buffers'] + mem['Cached']) // 1024,
+                 load=get_load(),
+                 cpu_busy=cpu_busy,
+                 disk_avail=get_disk_avail(),
+                 procs=self.sample_procs())
+        self.samples.append(s)
+        self.latest = s
+        add_span('sample', 'sampler', start, time.time(),
+                 mem_free=s['mem_free'], load=s['load'],
+                 cpu_busy=s['cpu_busy'])
+        return s
+
+    def sample_procs(self):
+        if self.lxd_pid is None:
+            return []
+        procs = [('lxd', self.lxd_pid)] + find_lxc_helpers(self.lxd_dir,
+                                                           self.seen_pids)
+        stats = []
+        for role, pid in procs:
+            st = read_proc_stats(pid)
+            if st is not None:
+                st.update(role=role, pid=pid)
+                stats.append(st)
+        return stats
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.sample()
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+        return self.sample()
+
+
+# where a container's cgroup (v2) may be, depending on the LXD version
+CGROUP_DIRS = ['/sys/fs/cgroup/lxc.payload.{}',
+               '/sys/fs/cgroup/lxc.payload/{}',
+               '/sys/fs/cgroup/lxc/{}']
+
+
+# returns dict(mem=bytes, cpu_time=sec, io=bytes read + written) from a
+# container's cgroup, or None if it has none, as when it is not running.
+# io is None when the io controller is not enabled for it.
+def read_cgroup_usage(name):
+    for fmt in CGROUP_DIRS:
+        path = fmt.format(name)
+        if os.path.exists(os.path.join(path, 'memory.current')):
+            break
+    else:
+        return None
+    try:
+        with open(os.path.join(path, 'memory.current'), 'r') as memf:
+            mem = int(memf.read())
+        cpu_time = 0.0
+        with open(os.path.join(path, 'cpu.stat'), 'r') as cpuf:
+            for line in cpuf:
+                key, val = line.split()
+                if key == 'usage_usec':
+                    cpu_time = int(val) / 1e6
+    except FileNotFoundError:
+        return None
+    io = None
+    try:
+        with open(os.path.join(path, 'io.stat'), 'r') as iof:
+            io = 0
+            # "8:0 rbytes=1 wbytes=2 rios=3 wios=4 dbytes=0 dios=0"
+            for line in iof:
+                for field in line.split()[1:]:
+                    key, val = field.split('=')
+                    if key in ('rbytes', 'wbytes'):
+                        io += int(val)
+    except FileNotFoundError:
+        pass
+    return dict(mem=mem, cpu_time=cpu_time, io=io)
+
+
+class ApiProber(threading.Thread):
+    """Times list and info queries at a fixed interval during a batch.
+
+    Plays another client of the daemon while the batch is launching or
+    copying containers: each tick it lists the containers, which also
+    tells how many there are right now, then asks for the info of one
+    of them. Every query is kept as (t, query, duration, containers,
+    ok), t being seconds since the prober started; a failed list gets
+    the count the last one found, or None before any succeeded.
+    """
+
+    LIST_CMD = "lxc list --format csv -c n"
+    INFO_CMD = "lxc info {}"
+
+    def __init__(self, interval, driver):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.driver = driver
+        self.probes = []
+        self.containers = None
+        self.start_time = time.time()
+        self.stopped = threading.Event()
+
+    def query(self, query, cmd, containers):
+        start = time.time()
+        try:
+            out = self.driver.run(cmd)
+            ok = True
+        except CalledProcessError:
+            out = None
+            ok = False
+        end = time.time()
+        add_span('probe', 'prober', start, end, query=query)
+        self.probes.append((start - self.start_time, query, end - start,
+                            containers, ok))
+        return out
+
+    def probe(self):
+        out = self.query('list', self.LIST_CMD, self.containers)
+        if out is None:
+            return
+        names = out.decode().split()
+        self.containers = len(names)
+        self.probes[-1] = self.probes[-1][:3] + (len(names), True)
+        if names:
+            self.query('info', self.INFO_CMD.format(random.choice(names)),
+                       len(names))
+
+    def run(self):
+        while not self.stopped.is_set():
+            start = time.time()
+            self.probe()
+            self.stopped.wait(max(0.0, start + self.interval - time.time()))
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+class BackendContext:
+    """One backend's LXD instance: where it lives and how to reach it.
+
+    Everything run against the backend uses ctx.env instead of the
+    process environment, and storage names are unique per instance, so
+    several backends can be driven side by side.
+    """
+
+    def __init__(self, backend, tmp_dir):
+        self.backend = backend
+        self.tmp_dir = tmp_dir
+        self.lxd_dir = os.path.join(tmp_dir, 'lxd_dir')
+        self.lxd_conf = os.path.join(tmp_dir, 'lxd_config')
+        self.socket_path = os.path.join(self.lxd_dir, 'unix.socket')
+        tag = os.path.basename(tmp_dir)
+        self.vg_name = 'LXDStorage-' + tag
+        self.pool_name = 'LXDStoragePool-' + tag
+        self.env = dict(os.environ, LXD_DIR=self.lxd_dir,
+                        LXD_CONF=self.lxd_conf)
+        self.lxd_proc = None
+        self.lxd_pid = None
+        self.startup_time = None
+        self.driver = None
+        self.dev = None
+        self.backingfile = None
+
+    def sh(self, cmd, **kwargs):
+        return check_output(cmd, shell=True, env=self.env, **kwargs)
+
+    def call(self, cmd):
+        return call(cmd, shell=True, env=self.env)
+
+
+def import_image(image, ctx):
     if os.path.exists(image):
         imagefile = os.path.abspath(image)
         print("importing image from file {}".format(imagefile))
         path, fname = os.path.split(imagefile)
         if fname.startswith('meta'):
             fname = fname[5:]
-        call("lxc image import {0}/meta-{1} {0}/{1} --alias img".format(path,
-                                                                        fname),
-             shell=True)
+        ctx.call("lxc image import {0}/meta-{1} {0}/{1} "
+                 "--alias img".format(path, fname))
     else:
         print("importing image '{}'".format(image))
         try:
-            check_output("{scriptpath}/lxd-images import {image} "
-                         " --alias img".format(scriptpath=LXD_SCRIPTS_DIR,
-                                               image=image),
-                         shell=True, stderr=STDOUT)
+            ctx.sh("{scriptpath}/lxd-images import {image} "
+                   " --alias img".format(scriptpath=LXD_SCRIPTS_DIR,
+                                         image=image),
+                   stderr=STDOUT)
         except CalledProcessError as e:
             print("out, \n{}".format(e.output))
             raise e
     print("done importing image '{}'".format(image))
 
 
-def delete_image():
-    check_output("lxc image delete img", shell=True)
+def delete_image(ctx):
+    ctx.sh("lxc image delete img")
 
 
-def setup_backend(backend, tmp_dir, opts):
-    lxd_dir = os.path.join(tmp_dir, 'lxd_dir')
-    os.makedirs(lxd_dir, exist_ok=True)
+def setup_backend(ctx, opts):
+    os.makedirs(ctx.lxd_dir, exist_ok=True)
+    backend = ctx.backend
+
+    if opts.driver == 'simulated':
+        # no daemon to start, the driver plays it in this process
+        ctx.lxd_pid = os.getpid()
+        ctx.startup_time = 0.0
+        return
 
     if backend == "dir":
-        lxd_proc = spawn_lxd(tmp_dir)
-        return dict(lxd_proc=lxd_proc)
+        spawn_lxd(ctx)
 
-    if backend == "lvm":
-        lxd_proc = spawn_lxd(tmp_dir)
+    elif backend == "lvm":
+        spawn_lxd(ctx)
         if opts.blockdev == "loop":
+            # the setup script always names its VG LXDStorage
+            ctx.vg_name = 'LXDStorage'
             try:
-                check_output("sudo -E {}/lxd-setup-lvm-storage "
-                             "-s 10G".format(LXD_SCRIPTS_DIR),
-                             shell=True, stderr=STDOUT, env=os.environ.copy())
+                ctx.sh("sudo -E {}/lxd-setup-lvm-storage "
+                       "-s 10G".format(LXD_SCRIPTS_DIR), stderr=STDOUT)
             except CalledProcessError as e:
                 print("output: " + e.output.decode())
                 raise e
         else:
-            check_output("sudo pvcreate {}".format(opts.blockdev), shell=True)
-            check_output("sudo vgcreate LXDStorage {}".format(opts.blockdev),
-                         shell=True)
-            check_output("lxc config set storage.lvm_vg_name LXDStorage",
-                         shell=True)
-
-        return dict(lxd_proc=lxd_proc)
+            ctx.sh("sudo pvcreate {}".format(opts.blockdev))
+            ctx.sh("sudo vgcreate {} {}".format(ctx.vg_name, opts.blockdev))
+            ctx.sh("lxc config set storage.lvm_vg_name {}".format(ctx.vg_name))
 
     elif backend in ['btrfs', 'zfs']:
-        backingfile = None
         if opts.blockdev == "loop":
-            backingfile = backend + '.img'
-            check_output("truncate -s {} {}".format('50G', backingfile),
-                         shell=True)
-            dev = check_output("sudo losetup -f",
-                               shell=True).decode().strip()
-            check_output("sudo losetup {} {}".format(dev, backingfile),
-                         shell=True)
+            ctx.backingfile = backend + '.img'
+            ctx.sh("truncate -s {} {}".format('50G', ctx.backingfile))
+            # find and attach in one go, or parallel backends could both
+            # be handed the same free device
+            ctx.dev = ctx.sh("sudo losetup -f --show "
+                             "{}".format(ctx.backingfile)).decode().strip()
         else:
-            dev = opts.blockdev
+            ctx.dev = opts.blockdev
 
         if backend == 'btrfs':
-            check_output("sudo mkfs.btrfs -m single {}".format(dev),
-                         shell=True)
-            check_output("sudo mount {} {}".format(dev, lxd_dir),
-                         shell=True)
-            lxd_proc = spawn_lxd(tmp_dir)
+            ctx.sh("sudo mkfs.btrfs -m single {}".format(ctx.dev))
+            ctx.sh("sudo mount {} {}".format(ctx.dev, ctx.lxd_dir))
+            spawn_lxd(ctx)
         else:
-            check_output("sudo zpool create -m none "
-                         "LXDStoragePool {}".format(dev),
-                         shell=True)
-            lxd_proc = spawn_lxd(tmp_dir)
-            check_output("lxc config set storage.zfs_pool_name LXDStoragePool",
-                         shell=True)
-
-        return dict(lxd_proc=lxd_proc, lxd_dir=lxd_dir,
-                    dev=dev, backingfile=backingfile)
+            ctx.sh("sudo zpool create -m none "
+                   "{} {}".format(ctx.pool_name, ctx.dev))
+            spawn_lxd(ctx)
+            ctx.sh("lxc config set storage.zfs_pool_name "
+                   "{}".format(ctx.pool_name))
     else:
         raise Exception("Unknown backend " + backend)
 
 
-def teardown_backend(backend, tmp_dir, info, opts):
-    if backend == "dir":
-        teardown_lxd(tmp_dir, info['lxd_proc'], opts)
+# returns how long the lxd daemon took to shut down
+def teardown_backend(ctx, opts):
+    backend = ctx.backend
+    if opts.driver == 'simulated':
+        return 0.0
+
+    elif backend == "dir":
+        return teardown_lxd(ctx, opts)
 
     elif backend == "lvm":
         if opts.blockdev == 'loop':
-            check_output("sudo -E {}/lxd-setup-lvm-storage "
-                         "--destroy".format(LXD_SCRIPTS_DIR),
-                         shell=True)
+            ctx.sh("sudo -E {}/lxd-setup-lvm-storage "
+                   "--destroy".format(LXD_SCRIPTS_DIR))
         else:
-            check_output("sudo vgremove -f LXDStorage", shell=True)
-            check_output("sudo pvremove -f {}".format(opts.blockdev),
-                         shell=True)
+            ctx.sh("sudo vgremove -f {}".format(ctx.vg_name))
+            ctx.sh("sudo pvremove -f {}".format(opts.blockdev))
 
-        teardown_lxd(tmp_dir, info['lxd_proc'], opts)
+        return teardown_lxd(ctx, opts)
 
     elif backend in ['btrfs', 'zfs']:
         if backend == 'btrfs':
-            teardown_lxd(tmp_dir, info['lxd_proc'], opts)
-            check_output("sudo umount {}".format(info['lxd_dir']), shell=True)
+            shutdown_time = teardown_lxd(ctx, opts)
+            ctx.sh("sudo umount {}".format(ctx.lxd_dir))
         else:
-            check_output("lxc config unset storage.zfs_pool_name", shell=True)
-            check_output("sudo zpool destroy LXDStoragePool", shell=True)
-            teardown_lxd(tmp_dir, info['lxd_proc'], opts)
+            ctx.sh("lxc config unset storage.zfs_pool_name")
+            ctx.sh("sudo zpool destroy {}".format(ctx.pool_name))
+            shutdown_time = teardown_lxd(ctx, opts)
 
         if opts.blockdev == 'loop':
-            check_output("sudo losetup -d {}".format(info['dev']), shell=True)
-            check_output("sudo rm -f {}".format(info['backingfile']),
-                         shell=True)
+            ctx.sh("sudo losetup -d {}".format(ctx.dev))
+            ctx.sh("sudo rm -f {}".format(ctx.backingfile))
         else:
-            check_output("sudo wipefs -a {}".format(info['dev']), shell=True)
-
-
-def do_launch(count, backend, opts, record=True):
-    tgtfmt = "ctr-{i}-" + backend
-    cmdfmt = "lxc launch img {target}"
-    return do_fmt('launch', cmdfmt, tgtfmt, count, backend, opts,
-                  record=record)
-
-
-def do_list(count, tag, backend, opts):
-    cmds = ["lxc list"]
-    return do_cmds('list-' + tag, cmds, count, backend, opts)
-
-
-def do_delete(to_delete, tag, count, backend, opts):
-    cmds = ["lxc delete  " + n for n in to_delete]
-    return do_cmds('delete-' + tag, cmds, count, backend, opts)
-
-
-def wait_for_cloudinit_done(container):
-    print("waiting for " + container)
-    for i in range(20):
-        time.sleep(2)
-        try:
-            result_json = check_output("lxc exec -- "
-                                       "sudo cat /run/cloud-init/result.json",
-                                       stderr=STDOUT,
-                                       shell=True)
-        except:
-            continue
-
-        if result == '':
-            continue
-
+            ctx.sh("sudo wipefs -a {}".format(ctx.dev))
+        return shutdown_time
+
+
+# bytes the backend's pool holds: containers, snapshots and images. Taken
+# from the storage itself rather than df, so other users of the host's
+# disks don't show up in it. None if it can not be read.
+# dir has no pool of its own to ask and walking all of lxd_dir is slow
+# and fills the page cache, so there only 'names', the containers and
+# snapshots given, are measured.
+def storage_used(ctx, opts, names=()):
+    if opts.driver == 'simulated':
+        return None
+    backend = ctx.backend
+    try:
+        if backend == 'zfs':
+            return int(ctx.sh("sudo zfs get -Hp -o value used "
+                              "{}".format(ctx.pool_name)))
+        if backend == 'lvm':
+            out = ctx.sh("sudo lvs --noheadings --units b --nosuffix "
+                         "-o lv_attr,lv_size,data_percent "
+                         "{}".format(ctx.vg_name))
+            used = 0
+            for line in out.decode().splitlines():
+                fields = line.split()
+                if fields[0].startswith('V'):
+                    # thin volumes are counted in their pool's data use
+                    continue
+                if fields[0].startswith('t'):
+                    used += int(float(fields[1]) * float(fields[2]) / 100)
+                else:
+                    used += int(fields[1])
+            return used
+        if backend == 'btrfs':
+            # the filesystem is lxd_dir's own
+            st = os.statvfs(ctx.lxd_dir)
+            return (st.f_blocks - st.f_bfree) * st.f_frsize
+        paths = []
+        for name in names:
+            if '/' in name:
+                paths.append(os.path.join(ctx.lxd_dir, 'snapshots', name))
+            else:
+                paths.append(os.path.join(ctx.lxd_dir, 'containers', name))
+        if not paths:
+            return 0
+        # -D: containers/<name> may be a symlink into a storage pool.
+        # targets already gone are skipped, the total counts the rest
+        out = ctx.sh("sudo du -scxD --block-size=1 {} 2>/dev/null "
+                     "|| true".format(" ".join(paths)))
+        return int(out.split()[-2])
+    except (CalledProcessError, ValueError, IndexError) as e:
+        print("could not read {} storage use: {}".format(backend, e))
+        return None
+
+
+# the milestones a container passes after it starts, in order, and the
+# command that checks for each: an IPv4 address on a global interface,
+# then cloud-init's result file
+READY_PROBES = {
+    'network': "lxc exec {} -- ip -4 -o addr show scope global",
+    'cloud-init': "lxc exec {} -- cat /run/cloud-init/result.json",
+}
+# the ops after which record_footprint measures what was created
+FOOTPRINT_OPS = ('launch', 'copy', 'snapshot')
+# the ops during which ApiProber runs
+PROBED_OPS = ('launch', 'copy')
+# the ops whose targets come up and can be waited for
+READY_OPS = ('launch', 'start', 'restart')
+READY_POLL_MIN = 0.1
+READY_POLL_MAX = 1.0
+
+
+# (whether container 'name' has reached 'stage', when the probe finished)
+def probe_ready(driver, name, stage):
+    start = time.time()
+    try:
+        out = driver.run(READY_PROBES[stage].format(name))
+    except CalledProcessError:
+        out = None
+    end = time.time()
+    add_span('probe', 'ready', start, end, target=name, stage=stage)
+    if not out or not out.strip():
+        return False, end
+    if stage == 'cloud-init':
         try:
-            ret = json.loads(result_json)
-        except:
-            continue
-
+            ret = json.loads(out)
+        except ValueError:
+            # still being written
+            return False, end
         errors = ret['v1']['errors']
-        if len(errors):
-            print(errors)
-            raise Exception("Cloud-init threw an error", errors)
-        break
-
-
-def do_pause(to_pause, count, backend, opts):
-    cmds = ["lxc pause " + name for name in to_pause]
-    return do_cmds('pause', cmds, count, backend, opts, record=False)
-
-
-def do_copy(source, count, backend, opts):
-    tgtfmt = "copy-{i}-" + backend
-    cmdfmt = "lxc copy  " + source + " {target}"
-    return do_fmt('copy', cmdfmt, tgtfmt, count, backend, opts)
-
-
-def do_snapshot(source, count, backend, opts):
-    tgtfmt = "snap-{i}-" + backend
-    cmdfmt = "lxc snapshot  " + source + " {target}"
-    snaps, err = do_fmt('snapshot', cmdfmt, tgtfmt, count, backend, opts)
-    return ([source + "/" + snap for snap in snaps], err)
+        if errors:
+            raise Exception("cloud-init in {} failed: {}".format(name,
+                                                                 errors))
+    return True, end
+
+
+def wait_ready(batch, names, started, count, ctx, opts, stages,
+               record=True):
+    """Polls every container in 'names' until it has passed each stage.
+
+    Containers are polled concurrently, each backing off from
+    READY_POLL_MIN to READY_POLL_MAX seconds between its probes, so how
+    often one is probed does not depend on how many are waiting. A
+    container moves on to its next stage as soon as one is reached.
+    With 'record', the time from each container's command in 'batch'
+    being issued to the end of the probe that found it ready is stored
+    as a batch named "<batch>-to-<stage>". Returns the containers that
+    reached every stage.
+    """
+    if not names or not stages:
+        return list(names)
+    workers = max(1, min(len(names), opts.max_inflight))
+    sampler = ResourceSampler(opts.sample_interval, ctx.lxd_pid,
+                              ctx.lxd_dir)
+    sampler.start()
+    writers = {}
+    if record:
+        start_all = min(started[name] for name in names)
+        writers = {stage: BatchWriter(batch + '-to-' + stage, count, ctx,
+                                      workers, start_all, opts)
+                   for stage in stages}
+    # (next poll, name, stage index, poll interval)
+    pending = [(time.time(), name, 0, READY_POLL_MIN) for name in names]
+    inflight = {}
+    ready = []
+    status = 'partial'
+    err = False
+    pool = ThreadPoolExecutor(workers)
+    try:
+        while (pending or inflight) and not sigusr_received:
+            pending.sort()
+            while pending and len(inflight) < workers:
+                if pending[0][0] > time.time():
+                    break
+                when, name, idx, interval = pending.pop(0)
+                fut = pool.submit(probe_ready, ctx.driver, name, stages[idx])
+                inflight[fut] = (name, idx, interval)
+            timeout = None
+            if pending and len(inflight) < workers:
+                timeout = max(0.0, pending[0][0] - time.time())
+            if not inflight:
+                time.sleep(timeout)
+                continue
+            done, _ = wait(inflight, timeout=timeout,
+                           return_when=FIRST_COMPLETED)
+            for fut in done:
+                name, idx, interval = inflight.pop(fut)
+                try:
+                    ok, end = fut.result()
+                except Exception as e:
+                    print("error: {}".format(e))
+                    err = True
+                    continue
+                stage = stages[idx]
+                if ok:
+                    if stage in writers:
+                        writers[stage].add(READY_PROBES[stage].format(name),
+                                           started[name], end,
+                                           sampler.samples)
+                    if idx + 1 == len(stages):
+                        ready.append(name)
+                    else:
+                        pending.append((end, name, idx + 1, READY_POLL_MIN))
+                elif end - started[name] > opts.ready_timeout:
+                    print("{} did not reach {} within {} seconds".format(
+                        name, stage, opts.ready_timeout))
+                    err = True
+                else:
+                    # poll one last time at the deadline
+                    when = min(end + interval,
+                               started[name] + opts.ready_timeout)
+                    pending.append((when, name, idx,
+                                    min(1.5 * interval, READY_POLL_MAX)))
+        if not sigusr_received:
+            status = 'failed' if err else 'complete'
+    finally:
+        pool.shutdown(cancel_futures=True)
+        sampler.stop()
+        for writer in writers.values():
+            writer.finish(sampler.samples, status)
+    return ready
 
 
 # do a formatted command 'nexec' times.
-def do_fmt(batchname, cmdfmt, tgtfmt, count, backend, opts,
-           nexec=None, record=True):
+def do_fmt(batchname, cmdfmt, tgtfmt, count, ctx, opts,
+           nexec=None, **kwargs):
     cmds = []
     tgts = []
     if nexec is None:
         nexec = count
     for i in range(nexec):
-        tgt = tgtfmt.format(i=i)
-        cmd = cmdfmt.format(target=tgt, backend=backend)
+        tgt = tgtfmt.format(i=i, backend=ctx.backend)
+        cmd = cmdfmt.format(target=tgt, backend=ctx.backend)
         cmds.append(cmd)
         tgts.append(tgt)
 
-    return do_cmds(batchname, cmds, count, backend, opts,
-                        targets=tgts, record=record)
+    return do_cmds(batchname, cmds, count, ctx, opts,
+                   targets=tgts, **kwargs)
 
 
 # do a list of things, ignoring but recording N
-def do_cmds(batchname, cmds, count, backend, opts, targets=None,
-            record=True):
+def do_cmds(batchname, cmds, count, ctx, opts, targets=None,
+            record=True, parallelism=None, think_time=0, rate=None,
+            arrivals='constant', durations=None, started=None,
+            probe=False):
     if sigusr_received:
         print("skipping.")
-        return []
+        return [], False
 
     def log(s):
         if opts.verbose:
             print(s)
 
-    recs = []
+    nrecs = 0
     completed_tgts = []
     if targets is None:
         targets = cmds
 
     assert(len(cmds) == len(targets))
     err = False
-    start_mem = get_free_mem()
-    start_load = get_load()
-    start_disk = get_disk_usage()
+    stop = False
+    if parallelism is None:
+        parallelism = opts.max_inflight if rate else opts.parallelism
+    parallelism = max(1, min(parallelism, len(cmds)))
+    schedule = None
+    if rate:
+        # seeded per batch, count and rate so each rate of a sweep gets
+        # its own arrival pattern rather than the same one stretched
+        schedule = arrival_times(len(cmds), rate, arrivals,
+                                 seed="{}-{}-{}".format(batchname, count,
+                                                        rate))
+    sampler = ResourceSampler(opts.sample_interval, ctx.lxd_pid,
+                              ctx.lxd_dir)
+    sampler.start()
+    prober = None
+    if probe and record and opts.probe_interval:
+        prober = ApiProber(opts.probe_interval, ctx.driver)
+        prober.start()
     start_all = time.time()
-    last_stoptime = None
-    for cmd, tgt in zip(cmds, targets):
+    writer = None
+    if record:
+        writer = BatchWriter(batchname, count, ctx, parallelism,
+                             start_all, opts, rate, scheduled_rate(schedule))
+    status = 'partial'
+
+    # keep up to 'parallelism' commands in flight. Completions are
+    # handled here in the calling thread, so the stop conditions are
+    # checked once per finished command; once one trips we stop
+    # dispatching and just wait for the commands already in flight.
+    # think_time is spent by a worker before each command after its first,
+    # outside of the measured duration.
+    # With a rate we run open loop instead: commands are dispatched at
+    # their scheduled arrival times whether or not earlier ones finished,
+    # 'parallelism' only caps the workers, and the time a command waits
+    # for a free worker is recorded as its queue delay.
+    engine = ENGINES[opts.engine](parallelism, ctx.driver)
+    batch_start = time.time()
+    inflight = {}
+    todo = iter(zip(cmds, targets))
+    ndispatched = 0
+    try:
+        while True:
+            timeout = None
+            while not stop:
+                if schedule is None:
+                    if len(inflight) >= parallelism:
+                        break
+                    scheduled = None
+                elif ndispatched < len(cmds):
+                    scheduled = start_all + schedule[ndispatched]
+                    if scheduled > time.time():
+                        timeout = scheduled - time.time()
+                        break
+                nxt = next(todo, None)
+                if nxt is None:
+                    break
+                log("+ " + str(nxt[0]))
+                delay = think_time if ndispatched >= parallelism else 0
+                if schedule is not None:
+                    delay = 0
+                fut = engine.submit(nxt[0], delay)
+                inflight[fut] = nxt + (scheduled, )
+                ndispatched += 1
+
+            if not inflight:
+                if timeout is None:
+                    break
+                time.sleep(timeout)
+                continue
+
+            done, _ = wait(inflight, timeout=timeout,
+                           return_when=FIRST_COMPLETED)
+            for fut in done:
+                cmd, tgt, scheduled = inflight.pop(fut)
+                try:
+                    start, end = fut.result()
+                except CalledProcessError as e:
+                    # if run failed, do not keep going and do not record
+                    # a timing
+                    print("error: {}".format(e))
+                    print("output: " + e.output.decode())
+                    print("Stopping run after {} due to the above "
+                          "error.".format(nrecs))
+                    err = True
+                    stop = True
+                    continue
+
+                completed_tgts.append(tgt)
+                dur = end - start
+                if durations is not None:
+                    durations[tgt] = dur
+                if started is not None:
+                    started[tgt] = start
+                log("=> OK, {:2f} sec".format(dur))
+
+                nrecs += 1
+                if writer is not None:
+                    queue_delay = None
+                    if scheduled is not None:
+                        queue_delay = max(0.0, start - scheduled)
+                    writer.add(cmd, start, end, sampler.samples,
+                               queue_delay)
+
+                if not stop:
+                    stop = should_stop(dur, nrecs, sampler.latest, opts)
+        status = 'failed' if err else 'complete'
+    finally:
+        engine.shutdown()
+        add_span('batch', 'batch', batch_start, time.time(), batch=batchname,
+                 count=count, parallelism=parallelism)
+        sampler.stop()
+        probes = []
+        if prober is not None:
+            prober.stop()
+            probes = prober.probes
+        # on the way out of an exception this still saves what we have,
+        # leaving the batch marked partial.
+        if writer is not None:
+            writer.finish(sampler.samples, status, probes)
+
+    return completed_tgts, err
+
+
+# offsets from the start of a batch at which to issue n commands at
+# 'rate' per second, evenly spaced or as a Poisson process drawn from
+# 'seed'
+def arrival_times(n, rate, arrivals='constant', seed=0):
+    if arrivals == 'constant':
+        return [i / rate for i in range(n)]
+    if arrivals != 'poisson':
+        raise Exception("unknown arrival process " + arrivals)
+    rng = random.Random(seed)
+    times = []
+    t = 0.0
+    for i in range(n):
+        times.append(t)
+        t += rng.expovariate(rate)
+    return times
+
+
+# the rate a schedule really offers, which for a Poisson one is only
+# about the nominal rate: commands issued over the span they were issued in
+def scheduled_rate(schedule):
+    if schedule is None or len(schedule) < 2:
+        return None
+    span = schedule[-1] - schedule[0]
+    return (len(schedule) - 1) / span if span > 0 else None
+
+
+# returns (lxd rss increase in kB, lxd cpu seconds, helpers rss in kB)
+# over a batch's samples
+def daemon_usage(samples):
+    def lxd(sample):
+        for p in sample['procs']:
+            if p['role'] == 'lxd':
+                return p
+        return None
+
+    first, last = lxd(samples[0]), lxd(samples[-1])
+    if first is None or last is None:
+        return None, None, None
+    helpers_rss = sum(p['rss'] for p in samples[-1]['procs']
+                      if p['role'] != 'lxd')
+    return (last['rss'] - first['rss'], last['cpu_time'] - first['cpu_time'],
+            helpers_rss)
+
+
+def should_stop(dur, nrecs, sample, opts):
+    if sample['mem_free'] + sample['mem_cached'] <= opts.mem_threshold:
+        print("stopping after {}, ran out of memory".format(nrecs))
+        return True
+    if dur > opts.duration_threshold:
+        print("stopping after {}, got impatient".format(nrecs))
+        return True
+    if sigusr_received:
+        print("stopping after {}, user asked to halt.".format(nrecs))
+        return True
+    return False
+
+
+def timed_cmd(driver, cmd, delay=0):
+    if delay:
+        time.sleep(delay)
+    start = time.time()
+    try:
+        driver.run(cmd)
+    finally:
+        end = time.time()
+        add_span('cmd', 'op', start, end, cmd=cmd)
+    return start, end
+
+
+class CliDriver:
+    """Runs each command through the lxc client in a shell."""
+
+    name = 'cli'
+    # what the harness adds to every command: spawning the shell
+    noop_cmd = 'true'
+
+    def __init__(self, ctx, opts):
+        self.env = ctx.env
+
+    def run(self, cmd):
         start = time.time()
-        log("+ " + str(cmd))
-        try:
-            check_output(cmd, shell=True, stderr=STDOUT)
-            completed_tgts.append(tgt)
-        except CalledProcessError as e:
-            # if run failed, do not keep going and do not record a timing
-            print("error: {}".format(e))
-            print("output: " + e.output.decode())
-            print("Stopping run after {} due to the above error.".format(len(recs)))
-            err = True
-            break
+        proc = Popen(cmd, shell=True, stdout=PIPE, stderr=STDOUT,
+                     env=self.env)
+        spawned = time.time()
+        out, _ = proc.communicate()
+        add_span('spawn', 'process', start, spawned)
+        add_span('run', 'process', spawned, time.time())
+        if proc.returncode != 0:
+            raise CalledProcessError(proc.returncode, cmd, output=out)
+        return out
 
-        last_stoptime = time.time()
-        dur = last_stoptime - start
-        log("=> OK, {:2f} sec".format(dur))
+    def close(self):
+        pass
 
-        recs.append((cmd, dur))
 
-        if get_free_mem(include_cached=True) <= opts.mem_threshold:
-            print("stopping after {}, ran out of memory".format(len(recs)))
-            break
-        if dur > opts.duration_threshold:
-            print("stopping after {}, got impatient".format(len(recs)))
-            break
-        if sigusr_received:
-            print("stopping after {}, user asked to halt.".format(len(recs)))
-            break
-    time_all = last_stoptime - start_all
-    mem_increase = get_free_mem() - start_mem
-    load_increase = get_load() - start_load
-    disk_increase = get_disk_usage() - start_disk
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, socket_path, timeout=None):
+        super().__init__('localhost', timeout=timeout)
+        self.socket_path = socket_path
 
-    if record:
-        record_batch(batchname, time_all, recs, count, backend,
-                     mem_increase, load_increase, disk_increase, opts)
-    return completed_tgts, err
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if self.timeout is not None:
+            sock.settimeout(self.timeout)
+        sock.connect(self.socket_path)
+        self.sock = sock
 
 
-def record_batch(name, time_all, recs, count, backend, mem_increase,
-                 load_increase, disk_increase, opts):
-    recavg = sum([t for _, t in recs]) / len(recs)
+class LXDError(Exception):
+    def __init__(self, msg, code=None):
+        super().__init__(msg)
+        self.code = code
 
-    c = dbc.execute("INSERT INTO timings(batch, backend, numrecs, count, "
-                    "total_time, avg_time, mem_increase, load_increase, "
-                    "disk_increase, image, run_id ) VALUES "
-                    "(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
-                    (name, backend, len(recs), count, time_all, recavg,
-                     mem_increase, load_increase, disk_increase,
-                     opts.image, run_id))
-    timings_id = c.lastrowid
-    for cmd, dur in recs:
-        dbc.execute("INSERT INTO recs(cmd, duration, timings_id) VALUES "
-                    "(?, ?, ?)", (cmd, dur, timings_id))
 
-    db.commit()
+class LXDClient:
+    """Minimal LXD REST client talking to $LXD_DIR/unix.socket.
+
+    Connections are kept alive and pooled, so each concurrent worker
+    reuses an open socket instead of connecting per request.
+    """
+
+    def __init__(self, socket_path, timeout=None):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self.pool = queue.LifoQueue()
+
+    def request(self, method, path, body=None):
+        with span('request', 'http', method=method, path=path):
+            return self._request(method, path, body)
+
+    def _request(self, method, path, body):
+        try:
+            conn = self.pool.get_nowait()
+            fresh = False
+        except queue.Empty:
+            conn = UnixHTTPConnection(self.socket_path, self.timeout)
+            fresh = True
+
+        headers = {}
+        payload = None
+        if body is not None:
+            payload = json.dumps(body)
+            headers['Content-Type'] = 'application/json'
+        try:
+            conn.request(method, path, body=payload, headers=headers)
+            resp = conn.getresponse()
+            data = json.loads(resp.read().decode())
+        except (http.client.RemoteDisconnected, BrokenPipeError,
+                ConnectionResetError):
+            conn.close()
+            if fresh:
+                raise
+            # the daemon dropped an idle pooled connection, retry once
+            # on a new one.
+            return self._request(method, path, body)
+        except Exception:
+            conn.close()
+            raise
+
+        self.pool.put(conn)
+        if data.get('type') == 'error':
+            raise LXDError("{} {}: {}".format(method, path, data.get('error')),
+                           data.get('error_code'))
+        return data
+
+    # block until a background operation finishes; sync responses are
+    # passed straight through.
+    def wait(self, resp):
+        if resp.get('type') != 'async':
+            return resp
+        with span('operation-wait', 'lxd', operation=resp['operation']):
+            result = self.request('GET', resp['operation'] + '/wait')
+        md = result['metadata']
+        if md.get('status_code') != 200:
+            raise LXDError("operation {} failed: {}".format(md.get('id'),
+                                                           md.get('err')),
+                           md.get('status_code'))
+        return result
+
+    def call(self, method, path, body=None):
+        return self.wait(self.request(method, path, body))
+
+    def close(self):
+        while True:
+            try:
+                self.pool.get_nowait().close()
+            except queue.Empty:
+                break
+
 
+class RestDriver:
+    """Runs lxc commands as direct REST calls over the LXD unix socket.
 
-def spawn_lxd(temp_dir):
-    lxd_config = os.path.join(temp_dir, 'lxd_config')
-    os.makedirs(lxd_config)
-    os.environ["LXD_CONF"] = lxd_config
-    lxd_dir = os.path.join(temp_dir, "lxd_dir")
-    os.environ["LXD_DIR"] = lxd_dir
+    Commands are still written as lxc command lines so batches and recs
+    look the same for both drivers; anything this driver does not know
+    how to translate is handed to the CLI.
+    """
+
+    name = 'rest'
+    noop_cmd = 'lxc noop'
+
+    def __init__(self, ctx, opts):
+        self.client = LXDClient(ctx.socket_path)
+        self.cli = CliDriver(ctx, opts)
+
+    def run(self, cmd):
+        args = shlex.split(cmd)
+        if len(args) < 2 or args[0] != 'lxc':
+            return self.cli.run(cmd)
+        op = getattr(self, 'op_' + args[1], None)
+        if op is None:
+            return self.cli.run(cmd)
+        try:
+            return op(*args[2:])
+        except (LXDError, OSError, http.client.HTTPException) as e:
+            # look like the CLI driver so do_cmds handles both the same
+            raise CalledProcessError(1, cmd, output=str(e).encode())
+
+    def close(self):
+        self.client.close()
+
+    def set_state(self, name, action, force=False):
+        self.client.call('PUT', '/1.0/containers/{}/state'.format(name),
+                         {'action': action, 'timeout': 30, 'force': force})
+
+    def op_launch(self, image, name):
+        self.client.call('POST', '/1.0/containers',
+                         {'name': name,
+                          'source': {'type': 'image', 'alias': image}})
+        self.set_state(name, 'start')
+
+    def op_list(self, *args):
+        ctrs = self.client.call('GET', '/1.0/containers?recursion=1')
+        # lxc list shows state too, which is one more request per container
+        for ctr in ctrs['metadata']:
+            self.client.call('GET',
+                             '/1.0/containers/{}/state'.format(ctr['name']))
+        return '\n'.join(ctr['name'] for ctr in ctrs['metadata']).encode()
+
+    def op_info(self, name):
+        self.client.call('GET', '/1.0/containers/{}'.format(name))
+        self.client.call('GET', '/1.0/containers/{}/state'.format(name))
+
+    def op_delete(self, *names):
+        for name in names:
+            if '/' in name:
+                ctr, snap = name.split('/', 1)
+                self.client.call('DELETE',
+                                 '/1.0/containers/{}/snapshots/{}'.format(
+                                     ctr, snap))
+                continue
+            state = self.client.call(
+                'GET', '/1.0/containers/{}/state'.format(name))
+            if state['metadata']['status'] != 'Stopped':
+                self.set_state(name, 'stop', force=True)
+            self.client.call('DELETE', '/1.0/containers/{}'.format(name))
+
+    def op_copy(self, source, name):
+        self.client.call('POST', '/1.0/containers',
+                         {'name': name,
+                          'source': {'type': 'copy', 'source': source}})
+
+    def op_snapshot(self, source, name):
+        self.client.call('POST',
+                         '/1.0/containers/{}/snapshots'.format(source),
+                         {'name': name, 'stateful': False})
+
+    def op_pause(self, name):
+        self.set_state(name, 'freeze')
+
+    def op_start(self, name):
+        self.set_state(name, 'start')
+
+    def op_stop(self, name):
+        self.set_state(name, 'stop')
+
+    def op_restart(self, name):
+        self.set_state(name, 'restart')
+
+    def op_restore(self, name, snapshot):
+        self.client.call('PUT', '/1.0/containers/{}'.format(name),
+                         {'restore': snapshot})
+
+    def op_publish(self, source, flag, alias):
+        self.client.call('POST', '/1.0/images',
+                         {'source': {'type': 'container', 'name': source},
+                          'aliases': [{'name': alias}]})
+
+    def op_image(self, action, alias):
+        if action != 'delete':
+            raise LXDError("image {} is not supported".format(action))
+        resp = self.client.call('GET', '/1.0/images/aliases/' + alias)
+        self.client.call('DELETE',
+                         '/1.0/images/' + resp['metadata']['target'])
+
+    def op_noop(self):
+        pass
+
+
+# "lognormal:2:0.3" -> function drawing a latency in seconds from an rng.
+# lognormal takes the median and the sigma of the log, exp the mean, and
+# a bare number is a constant.
+def latency_dist(spec):
+    kind, _, params = spec.partition(':')
+    if not params:
+        kind, params = 'const', spec
+    args = [float(a) for a in params.split(':')]
+    if kind == 'const':
+        return lambda rng: args[0]
+    if kind == 'uniform':
+        return lambda rng: rng.uniform(args[0], args[1])
+    if kind == 'normal':
+        return lambda rng: max(0.0, rng.gauss(args[0], args[1]))
+    if kind == 'lognormal':
+        return lambda rng: args[0] * math.exp(rng.gauss(0, args[1]))
+    if kind == 'exp':
+        return lambda rng: rng.expovariate(1 / args[0]) if args[0] else 0.0
+    raise Exception("unknown latency distribution " + kind)
+
+
+# "launch=lognormal:2:0.3,default=exp:0.05" -> {op: latency function}.
+# a part without an op sets the default.
+def parse_latencies(spec):
+    dists = {'default': latency_dist('0')}
+    for part in spec.split(','):
+        op, _, dist = part.rpartition('=')
+        dists[op.strip() or 'default'] = latency_dist(dist.strip())
+    return dists
+
+
+class SimulatedDriver:
+    """Stands in for the LXD daemon inside the harness process.
+
+    Each lxc command sleeps for a latency drawn from its op's
+    distribution, stretched by --sim-growth per container present, and
+    fails with probability --sim-fail. Launched and copied containers
+    hold --sim-mem MB each until deleted. A started container reaches
+    each READY_PROBES stage after a latency drawn for that stage's name
+    ('network', 'cloud-init'). This process plays the daemon
+    for the resource sampler, so runs, stop conditions and reports can
+    be exercised without root or LXD.
+    """
+
+    name = 'simulated'
+    noop_cmd = 'lxc noop'
+
+    def __init__(self, ctx, opts):
+        self.latency = parse_latencies(opts.sim_latency)
+        self.fail = opts.sim_fail
+        self.mem = int(opts.sim_mem * 2 ** 20)
+        self.growth = opts.sim_growth
+        self.rng = random.Random(opts.sim_seed)
+        self.slots = None
+        if opts.sim_slots:
+            # the daemon only works on this many requests at once
+            self.slots = threading.Semaphore(opts.sim_slots)
+        self.lock = threading.Lock()
+        self.containers = {}
+        self.snapshots = set()
+        self.stopped = set()
+        self.images = set()
+        # container -> {stage: time it is reached}
+        self.ready_at = {}
+
+    def run(self, cmd):
+        args = shlex.split(cmd)
+        if len(args) < 2 or args[0] != 'lxc':
+            raise CalledProcessError(127, cmd, output=b"not an lxc command")
+        if args[1] == 'noop':
+            return b''
+        with self.lock:
+            dist = self.latency.get(args[1], self.latency['default'])
+            delay = dist(self.rng) * (1 + self.growth * len(self.containers))
+            failed = self.rng.random() < self.fail
+        if self.slots is not None:
+            self.slots.acquire()
+        try:
+            time.sleep(delay)
+        finally:
+            if self.slots is not None:
+                self.slots.release()
+        if failed:
+            raise CalledProcessError(1, cmd, output="simulated {} "
+                                     "failure".format(args[1]).encode())
+        try:
+            with self.lock:
+                op = getattr(self, 'op_' + args[1], None)
+                if op is None:
+                    return b''
+                return op(*[a for a in args[2:] if not a.startswith('-')])
+        except (LXDError, TypeError) as e:
+            raise CalledProcessError(1, cmd, output=str(e).encode())
+
+    def close(self):
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.containers.clear()
+            self.snapshots.clear()
+            self.stopped.clear()
+            self.images.clear()
+            self.ready_at.clear()
+
+    def names(self):
+        with self.lock:
+            return sorted(self.containers)
+
+    def create(self, name):
+        if name in self.containers:
+            raise LXDError("container {} already exists".format(name))
+        mem = bytearray(self.mem)
+        # touch every page so the memory is really resident
+        mem[::4096] = b'\x01' * len(range(0, self.mem, 4096))
+        self.containers[name] = mem
+        self.boot(name)
+
+    def boot(self, name):
+        at = time.time()
+        self.ready_at[name] = {}
+        for stage in READY_PROBES:
+            dist = self.latency.get(stage, self.latency['default'])
+            at += dist(self.rng)
+            self.ready_at[name][stage] = at
+
+    def check(self, name):
+        if name not in self.containers:
+            raise LXDError("container {} not found".format(name))
+
+    def op_launch(self, image, name):
+        self.create(name)
+
+    def op_copy(self, source, name):
+        self.check(source)
+        self.create(name)
+
+    def op_snapshot(self, source, name):
+        self.check(source)
+        self.snapshots.add(source + '/' + name)
+
+    def op_delete(self, *names):
+        for name in names:
+            if '/' in name:
+                if name not in self.snapshots:
+                    raise LXDError("snapshot {} not found".format(name))
+                self.snapshots.remove(name)
+                continue
+            self.check(name)
+            del self.containers[name]
+            self.ready_at.pop(name, None)
+            self.stopped.discard(name)
+            self.snapshots = set(s for s in self.snapshots
+                                 if not s.startswith(name + '/'))
+
+    def op_start(self, name):
+        self.check(name)
+        if name not in self.stopped:
+            raise LXDError("container {} is already running".format(name))
+        self.stopped.remove(name)
+        self.boot(name)
+
+    def op_stop(self, name):
+        self.check(name)
+        if name in self.stopped:
+            raise LXDError("container {} is already stopped".format(name))
+        self.stopped.add(name)
+        self.ready_at.pop(name, None)
+
+    def op_restart(self, name):
+        self.check(name)
+        self.stopped.discard(name)
+        self.boot(name)
+
+    def op_restore(self, name, snapshot):
+        if name + '/' + snapshot not in self.snapshots:
+            raise LXDError("snapshot {}/{} not found".format(name, snapshot))
+
+    def op_publish(self, source, alias):
+        self.check(source)
+        if alias in self.images:
+            raise LXDError("image alias {} already exists".format(alias))
+        self.images.add(alias)
+
+    def op_image(self, action, alias):
+        if action == 'delete':
+            if alias not in self.images:
+                raise LXDError("image {} not found".format(alias))
+            self.images.remove(alias)
+
+    def op_list(self, *args):
+        return '\n'.join(sorted(self.containers)).encode()
+
+    def op_info(self, name):
+        self.check(name)
+
+    # what read_cgroup_usage would find for a stand-in container
+    def usage(self, name):
+        with self.lock:
+            if name not in self.containers or name in self.stopped:
+                return None
+            return dict(mem=len(self.containers[name]), cpu_time=0.0, io=0)
+
+    # answers the READY_PROBES as a container that is or is not up yet,
+    # and anything else with no output
+    def op_exec(self, name, *cmd):
+        self.check(name)
+        for stage, probe in READY_PROBES.items():
+            args = shlex.split(probe.format(name).partition(' -- ')[2])
+            if list(cmd) == [a for a in args if not a.startswith('-')]:
+                break
+        else:
+            return b''
+        reached = self.ready_at.get(name, {}).get(stage, math.inf)
+        if stage == 'network':
+            if reached > time.time():
+                return b''
+            return "2: eth0    inet 10.0.3.2/24 scope global".encode()
+        if reached > time.time():
+            raise LXDError("cat: /run/cloud-init/result.json: No such file")
+        return json.dumps({'v1': {'errors': []}}).encode()
+
+
+DRIVERS = {'cli': CliDriver,
+           'rest': RestDriver,
+           'simulated': SimulatedDriver}
+
+
+class ThreadEngine:
+    """Runs each command in a blocking subprocess call on a thread pool."""
+
+    def __init__(self, workers, driver):
+        self.driver = driver
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+
+    def submit(self, cmd, delay=0):
+        return self.pool.submit(timed_cmd, self.driver, cmd, delay)
+
+    def shutdown(self):
+        self.pool.shutdown()
+
+
+class AsyncioEngine:
+    """Runs commands as asyncio subprocesses on a private event loop.
+
+    The loop lives in a helper thread so submit() can hand back plain
+    concurrent.futures futures, just like ThreadEngine.
+    """
+
+    def __init__(self, workers, driver):
+        self.driver = driver
+        # every command runs on the loop's thread, so give concurrent ones
+        # their own lanes in the trace
+        self.lanes = []
+        self.nlanes = 0
+        self.loop = asyncio.new_event_loop()
+        self.loop.set_default_executor(ThreadPoolExecutor(max_workers=workers))
+        # subprocesses do not go through the executor, so cap them here;
+        # like a ThreadEngine worker, a command holds its slot through its
+        # think time, and what it waits for a slot counts as queue delay
+        self.slots = asyncio.Semaphore(workers)
+        self.thread = threading.Thread(target=self.loop.run_forever,
+                                       daemon=True)
+        self.thread.start()
+
+    def submit(self, cmd, delay=0):
+        return asyncio.run_coroutine_threadsafe(self._run(cmd, delay),
+                                                self.loop)
+
+    async def _run(self, cmd, delay):
+        async with self.slots:
+            return await self._run_slot(cmd, delay)
+
+    async def _run_slot(self, cmd, delay):
+        if delay:
+            await asyncio.sleep(delay)
+        if not isinstance(self.driver, CliDriver):
+            return await self.loop.run_in_executor(None, timed_cmd,
+                                                   self.driver, cmd)
+        if self.lanes:
+            lane = self.lanes.pop()
+        else:
+            lane = self.nlanes
+            self.nlanes += 1
+        thread = 'asyncio-{}'.format(lane)
+        start = time.time()
+        try:
+            proc = await asyncio.create_subprocess_shell(cmd, stdout=PIPE,
+                                                         stderr=STDOUT,
+                                                         env=self.driver.env)
+            spawned = time.time()
+            out, _ = await proc.communicate()
+            end = time.time()
+            add_span('spawn', 'process', start, spawned, thread)
+            add_span('run', 'process', spawned, end, thread)
+        finally:
+            add_span('cmd', 'op', start, time.time(), thread, cmd=cmd)
+            self.lanes.append(lane)
+        if proc.returncode != 0:
+            raise CalledProcessError(proc.returncode, cmd, output=out)
+        return start, end
+
+    def shutdown(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.run_until_complete(self.loop.shutdown_default_executor())
+        self.loop.close()
+
+
+ENGINES = {'thread': ThreadEngine,
+           'asyncio': AsyncioEngine}
+
+
+# Latency histogram buckets. Bucket e * HIST_SUB + s holds durations from
+# 2^e * (1 + s / HIST_SUB) to 2^e * (1 + (s + 1) / HIST_SUB) microseconds,
+# so every value is kept to within 1 / HIST_SUB of itself, from 1us to
+# about 12 days.
+HIST_SUB = 128
+HIST_BUCKETS = 40 * HIST_SUB
+
+
+class Histogram:
+    """HDR style log-bucketed latency histogram.
+
+    Histograms of the same batch from repetitions or different runs merge
+    by adding counts. to_blob() packs the non-empty buckets, which is a
+    few hundred bytes for a typical batch.
+    """
+
+    def __init__(self, counts=None):
+        if counts is None:
+            counts = np.zeros(HIST_BUCKETS, dtype=np.int64)
+        self.counts = counts
+
+    @staticmethod
+    def index(durs):
+        us = np.maximum(np.asarray(durs, dtype=float) * 1e6, 1.0)
+        m, e = np.frexp(us)
+        idx = (e - 1) * HIST_SUB + ((2 * m - 1) * HIST_SUB).astype(np.int64)
+        return np.minimum(idx, HIST_BUCKETS - 1)
+
+    # midpoint of each bucket, in seconds
+    @staticmethod
+    def value(idx):
+        e, s = np.divmod(idx, HIST_SUB)
+        return np.ldexp(1 + (s + 0.5) / HIST_SUB, e) / 1e6
+
+    def add(self, durs):
+        np.add.at(self.counts, self.index(durs), 1)
+
+    def merge(self, other):
+        self.counts = self.counts + other.counts
+        return self
+
+    def total(self):
+        return int(self.counts.sum())
+
+    def percentile(self, q):
+        cum = np.cumsum(self.counts)
+        rank = np.maximum(np.ceil(np.asarray(q) / 100.0 * cum[-1]), 1)
+        return self.value(np.searchsorted(cum, rank))
+
+    # every recorded duration as its bucket's midpoint, in bucket order
+    def values(self):
+        idx = np.flatnonzero(self.counts)
+        return np.repeat(self.value(idx), self.counts[idx])
+
+    def to_blob(self):
+        idx = np.flatnonzero(self.counts)
+        return zlib.compress(struct.pack('<I', len(idx)) +
+                             idx.astype('<u2').tobytes() +
+                             self.counts[idx].astype('<u8').tobytes())
+
+    @classmethod
+    def from_blob(cls, blob):
+        raw = zlib.decompress(blob)
+        n = struct.unpack_from('<I', raw)[0]
+        idx = np.frombuffer(raw, '<u2', n, 4)
+        counts = np.zeros(HIST_BUCKETS, dtype=np.int64)
+        counts[idx] = np.frombuffer(raw, '<u8', n, 4 + 2 * n)
+        return cls(counts)
+
+
+class BatchWriter:
+    """Streams one batch's recs and samples into the db as they complete.
+
+    The timings row is created up front and marked 'partial' until
+    finish() fills in the totals, so a batch that fails or is stopped
+    before anything completes is still on record, and whatever was
+    measured before a crash or an interrupted run is already on disk.
+    Rows are written with executemany and committed every FLUSH_RECS
+    recs or FLUSH_SECS seconds.
+    finish() also stores a Histogram of the durations; with --no-recs
+    that is all that is kept of them.
+    """
+
+    FLUSH_RECS = 100
+    FLUSH_SECS = 5.0
+
+    def __init__(self, name, count, ctx, parallelism, start_all, opts,
+                 rate=None, scheduled_rate=None):
+        self.name = name
+        self.rate = rate
+        self.scheduled_rate = scheduled_rate
+        self.count = count
+        self.ctx = ctx
+        self.parallelism = parallelism
+        self.start_all = start_all
+        self.opts = opts
+        c = dbc.execute("INSERT INTO timings(batch, backend, numrecs, "
+                        "count, image, run_id, parallelism, driver, "
+                        "status, offered_rate, scheduled_rate) VALUES "
+                        "(?, ?, 0, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        (name, ctx.backend, count, opts.image, run_id,
+                         parallelism, ctx.driver.name, 'partial', rate,
+                         scheduled_rate))
+        self.timings_id = c.lastrowid
+        db.commit()
+        self.recs = []
+        self.nrecs = 0
+        self.total_dur = 0.0
+        self.last_stoptime = None
+        self.nsamples = 0
+        self.last_flush = time.time()
+        self.hist = Histogram()
+
+    def add(self, cmd, start, end, samples, queue_delay=None):
+        self.hist.add(end - start)
+        if self.opts.keep_recs:
+            self.recs.append((cmd, end - start, self.timings_id,
+                              start - self.start_all, queue_delay))
+        self.nrecs += 1
+        self.total_dur += end - start
+        if self.last_stoptime is None or end > self.last_stoptime:
+            self.last_stoptime = end
+        if (len(self.recs) >= self.FLUSH_RECS or
+                time.time() - self.last_flush >= self.FLUSH_SECS):
+            self.flush(samples)
+
+    def flush(self, samples):
+        start = time.time()
+        dbc.executemany("INSERT INTO recs(cmd, duration, timings_id, "
+                        "started, queue_delay) VALUES (?, ?, ?, ?, ?)",
+                        self.recs)
+        self.recs = []
+
+        new = samples[self.nsamples:]
+        self.nsamples += len(new)
+        dbc.executemany("INSERT INTO samples(timings_id, t, mem_free, "
+                        "mem_cached, load, cpu_busy, disk_avail) VALUES "
+                        "(?, ?, ?, ?, ?, ?, ?)",
+                        [(self.timings_id, s['t'], s['mem_free'],
+                          s['mem_cached'], s['load'], s['cpu_busy'],
+                          s['disk_avail']) for s in new])
+        dbc.executemany("INSERT INTO proc_samples(timings_id, t, role, pid, "
+                        "rss, cpu_time, threads, fds) VALUES "
+                        "(?, ?, ?, ?, ?, ?, ?, ?)",
+                        [(self.timings_id, s['t'], p['role'], p['pid'],
+                          p['rss'], p['cpu_time'], p['threads'], p['fds'])
+                         for s in new for p in s['procs']])
+        add_span('db-write', 'db', start, time.time(), batch=self.name)
+        save_spans(self.ctx.backend)
+        db.commit()
+        self.last_flush = time.time()
+
+    def finish(self, samples, status, probes=()):
+        self.flush(samples)
+        dbc.executemany("INSERT INTO probes(timings_id, t, query, duration, "
+                        "containers, ok) VALUES (?, ?, ?, ?, ?, ?)",
+                        [(self.timings_id, ) + p for p in probes])
+        time_all = avg_time = None
+        if self.nrecs:
+            time_all = self.last_stoptime - self.start_all
+            avg_time = self.total_dur / self.nrecs
+        first, last = samples[0], samples[-1]
+        lxd_rss_increase, lxd_cpu_time, helpers_rss = daemon_usage(samples)
+        dbc.execute("UPDATE timings SET numrecs = ?, total_time = ?, "
+                    "avg_time = ?, mem_increase = ?, load_increase = ?, "
+                    "disk_increase = ?, ops_per_sec = ?, "
+                    "lxd_rss_increase = ?, lxd_cpu_time = ?, "
+                    "helpers_rss = ?, status = ?, hist = ? WHERE id = ?",
+                    (self.nrecs, time_all, avg_time,
+                     last['mem_free'] - first['mem_free'],
+                     last['load'] - first['load'],
+                     last['disk_avail'] - first['disk_avail'],
+                     self.nrecs / time_all if time_all else None,
+                     lxd_rss_increase, lxd_cpu_time, helpers_rss, status,
+                     self.hist.to_blob(), self.timings_id))
+        db.commit()
+
+
+def spawn_lxd(ctx):
+    os.makedirs(ctx.lxd_conf)
     for fn in ['server.crt', 'server.key']:
         shutil.copyfile(os.path.join(LXD_SRC_DIR, 'test', 'deps', fn),
-                        os.path.join(temp_dir, fn))
-    out = open("{}/debug.log".format(temp_dir), 'wb')
-    lxd_proc = Popen(["sudo", "-E", "{}/bin/lxd".format(os.environ["GOPATH"]),
-                      "--debug", "--group", "lxd", "--logfile",
-                      "{}/lxd.log".format(lxd_dir)], stdout=out, stderr=STDOUT)
+                        os.path.join(ctx.tmp_dir, fn))
+    out = open("{}/debug.log".format(ctx.tmp_dir), 'wb')
+    start = time.time()
+    ctx.lxd_proc = Popen(["sudo", "-E",
+                          "{}/bin/lxd".format(os.environ["GOPATH"]),
+                          "--debug", "--group", "lxd", "--logfile",
+                          "{}/lxd.log".format(ctx.lxd_dir)],
+                         stdout=out, stderr=STDOUT, env=ctx.env)
 
     print("waiting for spawned lxd")
-    rv = -1
-    while rv != 0:
-        cmd = "lxc finger "
-        rv = call(cmd, shell=True)
-        time.sleep(1.5)
+    wait_for_lxd(ctx.socket_path, ctx.lxd_proc)
+    add_span('lxd-start', 'backend', start, time.time())
+    ctx.startup_time = time.time() - start
+    ctx.lxd_pid = find_child_pid(ctx.lxd_proc.pid)
+    print("lxd up after {:.2f} sec".format(ctx.startup_time))
 
     # check_call("lxc config  "
     #            " set core.https_address 127.0.0.1:22222",
     #            shell=True)
     # check_call("lxc config  "
     #            "set core.trust_password foo", shell=True)
-    return lxd_proc
 
 
-def teardown_lxd(tmp_dir, lxd_proc, opts):
-    lxd_pid = check_output("pgrep -P " + str(lxd_proc.pid),
-                           shell=True)
-    lxd_pid = int(lxd_pid.decode())
+# poll GET /1.0 on the daemon's socket, backing off from 10ms to 250ms,
+# until it answers
+def wait_for_lxd(socket_path, lxd_proc, timeout=300):
+    deadline = time.time() + timeout
+    delay = 0.01
+    while True:
+        client = LXDClient(socket_path, timeout=5)
+        try:
+            client.request('GET', '/1.0')
+            return
+        except (OSError, LXDError, http.client.HTTPException, ValueError):
+            pass
+        finally:
+            client.close()
+        if lxd_proc.poll() is not None:
+            raise Exception("lxd exited with {} while starting, see "
+                            "debug.log".format(lxd_proc.returncode))
+        if time.time() > deadline:
+            raise Exception("lxd did not come up within {} "
+                            "sec".format(timeout))
+        time.sleep(delay)
+        delay = min(delay * 2, 0.25)
+
+
+def pid_alive(pid):
+    try:
+        with open('/proc/{}/stat'.format(pid), 'r') as statf:
+            data = statf.read()
+    except (FileNotFoundError, ProcessLookupError):
+        return False
+    # an exited child that hasn't been reaped yet counts as gone
+    return data[data.rindex(')') + 2] != 'Z'
+
+
+# wait up to 'timeout' seconds for pid to exit, returns whether it did
+def wait_for_exit(pid, timeout):
+    deadline = time.time() + timeout
+    delay = 0.01
+    while pid_alive(pid):
+        if time.time() > deadline:
+            return False
+        time.sleep(delay)
+        delay = min(delay * 2, 0.25)
+    return True
+
+
+# stops the daemon, returns how long it took to exit after SIGTERM
+def teardown_lxd(ctx, opts):
+    lxd_pid = ctx.lxd_pid
     print("killing lxd pid {}".format(lxd_pid))
 
+    start = time.time()
     call("sudo kill -15 {}".format(lxd_pid), shell=True)
-    time.sleep(2)
-    call("sudo kill -9 {}".format(lxd_pid), shell=True)
+    if not wait_for_exit(lxd_pid, 30):
+        print("lxd ignored SIGTERM, killing it")
+        call("sudo kill -9 {}".format(lxd_pid), shell=True)
+        wait_for_exit(lxd_pid, 30)
+    shutdown_time = time.time() - start
+    add_span('lxd-stop', 'backend', start, start + shutdown_time)
 
     while True:
         try:
             pid = check_output("ps aux | grep lxc-monitord "
-                               "| grep {}/lxd_dir "
-                               "| grep -v grep".format(tmp_dir),
+                               "| grep {} "
+                               "| grep -v grep".format(ctx.lxd_dir),
                                shell=True)
             pid = pid.decode().split()[1]
             call("sudo kill -9 {}".format(pid), shell=True)
         except CalledProcessError:
             break
         time.sleep(1)
+    return shutdown_time
+
+
+# op name: (command format, name format for what it creates). Ops with a
+# name format create containers or snapshots, the rest act on a saved
+# set of targets or, like list, on nothing.
+OPS = {
+    'launch': ("lxc launch img {target}", "ctr-{i}-{backend}"),
+    'copy': ("lxc copy  {source} {target}", "copy-{i}-{backend}"),
+    'snapshot': ("lxc snapshot  {source} {target}", "snap-{i}-{backend}"),
+    'list': ("lxc list", None),
+    'delete': ("lxc delete  {target}", None),
+    'pause': ("lxc pause {target}", None),
+    'start': ("lxc start {target}", None),
+    'stop': ("lxc stop {target}", None),
+    'restart': ("lxc restart {target}", None),
+    # targets are snapshots, as saved from a snapshot step
+    'restore': ("lxc restore {container} {snapshot}", None),
+    'publish': ("lxc publish {source} --alias {target}", "img-{i}-{backend}"),
+    'delete-image': ("lxc image delete {target}", None),
+}
+
+# The sequence run_bench always ran: launch, list and delete N
+# containers, then make N copies and N snapshots of a paused template.
+DEFAULT_SCENARIO = {
+    'name': 'default',
+    'fixtures': {
+        'template': [
+            {'op': 'launch', 'count': 1, 'record': False,
+             'wait_cloudinit': True},
+            {'op': 'pause', 'targets': 'template', 'record': False},
+        ],
+    },
+    'phases': [
+        {'name': 'containers', 'steps': [
+            {'op': 'launch', 'save': 'launched'},
+            {'op': 'list', 'batch': 'list-containers'},
+            {'op': 'delete', 'targets': 'launched',
+             'batch': 'delete-containers'},
+        ]},
+        {'name': 'copies', 'uses': ['template'], 'steps': [
+            {'op': 'copy', 'source': 'template', 'save': 'copies'},
+            {'op': 'list', 'batch': 'list-copies'},
+            {'op': 'delete', 'targets': 'copies', 'batch': 'delete-copies'},
+        ]},
+        {'name': 'snapshots', 'uses': ['template'], 'steps': [
+            {'op': 'snapshot', 'source': 'template'},
+            # deleting the template will delete the snapshots too:
+            {'op': 'delete', 'targets': 'template',
+             'batch': 'delete-container-with-snaps'},
+        ]},
+    ],
+}
+
+# Open loop launches at increasing Poisson arrival rates, to find where
+# each backend stops keeping up.
+OPENLOOP_SCENARIO = {
+    'name': 'openloop',
+    'phases': [
+        {'name': 'launch-rates', 'steps': [
+            {'op': 'launch', 'rates': [0.25, 0.5, 1, 2, 4, 8],
+             'arrivals': 'poisson'},
+        ]},
+    ],
+}
+
+# Storage data plane: N containers running the same I/O workload at once.
+IO_SCENARIO = {
+    'name': 'io',
+    'phases': [
+        {'name': 'io', 'steps': [
+            {'op': 'launch', 'save': 'io', 'record': False,
+             'wait_cloudinit': True},
+            {'op': 'io', 'targets': 'io', 'workload': 'seqwrite'},
+            {'op': 'io', 'targets': 'io', 'workload': 'seqread'},
+            {'op': 'io', 'targets': 'io', 'workload': 'randwrite'},
+            {'op': 'io', 'targets': 'io', 'workload': 'randread'},
+            {'op': 'io', 'targets': 'io', 'workload': 'smallfiles'},
+            {'op': 'delete', 'targets': 'io', 'record': False},
+        ]},
+    ],
+}
+
+# What restarting and rolling back existing containers costs: stop, start
+# and restart N containers one at a time, then start all N at once (a
+# boot storm); restore N snapshots of a stopped template and publish it
+# as an image a few times.
+LIFECYCLE_SCENARIO = {
+    'name': 'lifecycle',
+    'fixtures': {
+        'template': [
+            {'op': 'launch', 'count': 1, 'record': False,
+             'wait_cloudinit': True},
+            {'op': 'stop', 'targets': 'template', 'record': False},
+        ],
+    },
+    'phases': [
+        {'name': 'restarts', 'steps': [
+            {'op': 'launch', 'save': 'ctrs', 'record': False,
+             'wait_cloudinit': True},
+            {'op': 'stop', 'targets': 'ctrs'},
+            {'op': 'start', 'targets': 'ctrs'},
+            {'op': 'restart', 'targets': 'ctrs'},
+            {'op': 'stop', 'targets': 'ctrs', 'record': False},
+            {'op': 'start', 'targets': 'ctrs', 'batch': 'boot-storm',
+             'parallelism': 'N'},
+            {'op': 'delete', 'targets': 'ctrs', 'record': False},
+        ]},
+        {'name': 'restores', 'uses': ['template'], 'steps': [
+            {'op': 'snapshot', 'source': 'template', 'save': 'snaps',
+             'record': False},
+            {'op': 'restore', 'targets': 'snaps'},
+        ]},
+        {'name': 'publish', 'uses': ['template'], 'steps': [
+            {'op': 'publish', 'source': 'template', 'count': 'N/4',
+             'save': 'images'},
+            {'op': 'delete-image', 'targets': 'images', 'record': False},
+            {'op': 'delete', 'targets': 'template', 'record': False},
+        ]},
+    ],
+}
+
+# How long launched containers take to become usable: time from launch
+# to network up and, on cloud images, to cloud-init done, for N
+# containers launched together and for the same N booted again at once.
+READY_SCENARIO = {
+    'name': 'ready',
+    'phases': [
+        {'name': 'ready', 'steps': [
+            {'op': 'launch', 'save': 'ctrs', 'ready': True},
+            {'op': 'stop', 'targets': 'ctrs', 'record': False},
+            {'op': 'start', 'targets': 'ctrs', 'batch': 'boot-storm',
+             'parallelism': 'N', 'ready': True},
+            {'op': 'delete', 'targets': 'ctrs', 'record': False},
+        ]},
+    ],
+}
+
+SCENARIOS = {'default': DEFAULT_SCENARIO,
+             'openloop': OPENLOOP_SCENARIO,
+             'io': IO_SCENARIO,
+             'lifecycle': LIFECYCLE_SCENARIO,
+             'ready': READY_SCENARIO}
+
+# fio options and block size of each io step workload. All of them work
+# on the same file, so the reads find what seqwrite laid out; smallfiles
+# creates and removes many tiny files from the shell instead.
+IO_WORKLOADS = {
+    'seqwrite': ('--rw=write --end_fsync=1', '1M'),
+    'seqread': ('--rw=read --invalidate=1', '1M'),
+    'randwrite': ('--rw=randwrite --end_fsync=1', '4k'),
+    'randread': ('--rw=randread --invalidate=1', '4k'),
+    'smallfiles': (None, None),
+}
+IO_FILE = '/var/tmp/bench-io.dat'
+FIO_CMD = ("fio --name={workload} --filename={file} --size={size} "
+           "--bs={bs} {args} --ioengine=psync --runtime={runtime} "
+           "--output-format=json --output=/var/tmp/fio-{workload}.json")
+SMALLFILES_CMD = ("sh -c 'mkdir -p /var/tmp/bench-files && "
+                  "cd /var/tmp/bench-files && i=0 && "
+                  "while [ $i -lt {nfiles} ]; do echo x > f$i; i=$((i+1)); "
+                  "done && sync && cd / && rm -rf /var/tmp/bench-files'")
+
+
+def load_scenario(name):
+    """Returns the built-in scenario 'name', or loads it from a file.
+
+    Files ending in .toml are read as TOML, anything else as JSON.
+    """
+    if name in SCENARIOS:
+        scenario = SCENARIOS[name]
+    elif name.endswith('.toml'):
+        if tomllib is None:
+            raise Exception("TOML scenarios need python 3.11 or later")
+        with open(name, 'rb') as f:
+            scenario = tomllib.load(f)
+    else:
+        with open(name, 'r') as f:
+            scenario = json.load(f)
+    check_scenario(scenario)
+    return scenario
+
+
+def check_scenario(scenario):
+    fixtures = scenario.get('fixtures', {})
+    steps = [s for p in scenario['phases'] for s in p['steps']]
+    steps += [s for f in fixtures.values() for s in f]
+    for phase in scenario['phases']:
+        if 'name' not in phase:
+            raise Exception("scenario phase without a name")
+        for fixture in phase.get('uses', []):
+            if fixture not in fixtures:
+                raise Exception("phase {} uses unknown fixture "
+                                "{}".format(phase['name'], fixture))
+    # the sets of containers, snapshots or images steps can refer to
+    sets = set(fixtures) | set(s['save'] for s in steps if 'save' in s)
+    for step in steps:
+        for entry in step.get('mix', [step]):
+            if entry['op'] not in OPS and entry['op'] not in ('mix', 'io'):
+                raise Exception("unknown op {}".format(entry['op']))
+            check_step_sets(entry, sets)
+        if step['op'] == 'io' and step.get('workload') not in IO_WORKLOADS:
+            raise Exception("unknown io workload {}".format(
+                step.get('workload')))
+        if ('rates' in step and 'save' in step and
+                step.get('cleanup', True)):
+            raise Exception("a {} step sweeping rates deletes what each rate "
+                            "made; set cleanup to false to save "
+                            "it".format(step['op']))
+        if ((step.get('ready') or step.get('wait_cloudinit')) and
+                step['op'] not in READY_OPS):
+            raise Exception("{} steps can not wait for their targets to be "
+                            "ready".format(step['op']))
+        if 'rates' in step and step['op'] not in OPS:
+            raise Exception("{} steps can not sweep rates".format(
+                step['op']))
+        for entry in step.get('mix', []):
+            if entry['op'] not in OPS:
+                raise Exception("{} can not be part of a mix".format(
+                    entry['op']))
+            if entry['op'] == 'delete':
+                raise Exception("delete can not be part of a mix")
+
+
+# check that a step (or mix entry) names the sets its op needs, and only
+# sets the scenario makes
+def check_step_sets(step, sets):
+    op = step['op']
+    if op in OPS:
+        cmdfmt, tgtfmt = OPS[op]
+        if '{source}' in cmdfmt and 'source' not in step:
+            raise Exception("{} steps need a source".format(op))
+        uses_target = any(f in cmdfmt for f in ('{target}', '{container}',
+                                                 '{snapshot}'))
+        if (uses_target and tgtfmt is None and 'name' not in step and
+                'targets' not in step):
+            raise Exception("{} steps need targets".format(op))
+    elif op == 'io' and 'targets' not in step:
+        raise Exception("io steps need targets")
+    for key in ('source', 'targets'):
+        if key in step and step[key] not in sets:
+            raise Exception("{} step {} {} is neither a fixture nor saved by "
+                            "any step".format(op, key, step[key]))
+
+
+# a step count is an int or an expression of the sweep's N like "N",
+# "2*N" or "N/4"
+def resolve_count(expr, count):
+    if isinstance(expr, int):
+        return expr
+    expr = expr.replace(' ', '')
+    if expr == 'N':
+        return count
+    if expr.startswith('N*'):
+        return int(count * float(expr[2:]))
+    if expr.endswith('*N'):
+        return int(count * float(expr[:-2]))
+    if expr.startswith('N/'):
+        return max(1, int(count / float(expr[2:])))
+    return int(expr)
+
+
+# what a command format can use for a target: the name itself and, for a
+# snapshot "ctr/snap", its container and snapshot names
+def target_fields(target):
+    container, _, snapshot = str(target).partition('/')
+    return dict(target=target, container=container, snapshot=snapshot)
+
+
+# build the commands for a step mixing several ops, drawn by weight
+def mix_cmds(step, n, ctx, state):
+    rng = random.Random(step.get('seed', 0))
+    entries = step['mix']
+    weights = [e.get('weight', 1) for e in entries]
+    cmds = []
+    tgts = []
+    for i in range(n):
+        entry = rng.choices(entries, weights)[0]
+        cmdfmt, tgtfmt = OPS[entry['op']]
+        tgtfmt = entry.get('name', tgtfmt)
+        if tgtfmt is not None:
+            tgt = tgtfmt.format(i=i, backend=ctx.backend)
+        elif 'targets' in entry:
+            if not state.get(entry['targets']):
+                raise Exception("no {} left to {} in the mix".format(
+                    entry['targets'], entry['op']))
+            tgt = rng.choice(state[entry['targets']])
+        else:
+            tgt = None
+        source = state[entry['source']][0] if 'source' in entry else ''
+        cmds.append(cmdfmt.format(source=source, **target_fields(tgt)))
+        tgts.append(tgt if tgt is not None else cmds[-1])
+    return cmds, tgts
+
+
+# run a step once per offered rate, by default removing what each rate
+# created before trying the next one
+def run_rate_sweep(step, count, ctx, opts, state, scenario):
+    creates = OPS[step['op']][1] is not None
+    cleanup = creates and step.get('cleanup', True)
+    done = []
+    for j, rate in enumerate(step['rates']):
+        print("**** offered rate {}/s".format(rate))
+        sub = dict(step, rate=rate)
+        del sub['rates']
+        if cleanup:
+            sub['save'] = '_sweep'
+        elif creates:
+            # what every rate made is kept, under the step's save, so each
+            # rate needs names of its own
+            sub['name'] = "{}-r{}".format(step.get('name', OPS[step['op']][1]),
+                                         j)
+        done = run_step(sub, count, ctx, opts, state, scenario)
+        if cleanup:
+            run_step({'op': 'delete', 'targets': '_sweep', 'record': False},
+                     count, ctx, opts, state, scenario)
+            del state['_sweep']
+    return done
+
+
+def run_step(step, count, ctx, opts, state, scenario):
+    op = step['op']
+    if 'rates' in step:
+        return run_rate_sweep(step, count, ctx, opts, state, scenario)
+    batch = step.get('batch', op)
+    parallelism = step.get('parallelism', scenario.get('parallelism'))
+    if parallelism is not None:
+        parallelism = resolve_count(parallelism, count)
+    # have other clients' queries timed while containers are created
+    probe = any(e['op'] in PROBED_OPS for e in step.get('mix', [step]))
+    kwargs = dict(record=step.get('record', True),
+                  parallelism=parallelism,
+                  think_time=step.get('think_time',
+                                      scenario.get('think_time', 0)),
+                  probe=probe)
+    started = kwargs['started'] = {}
+    footprint = op in FOOTPRINT_OPS and kwargs['record']
+    if footprint:
+        # dir only measures the new targets, which start out empty
+        storage_base = 0
+        if ctx.backend != 'dir':
+            storage_base = storage_used(ctx, opts)
+    if 'rate' in step:
+        kwargs.update(rate=step['rate'],
+                      arrivals=step.get('arrivals',
+                                        scenario.get('arrivals', 'constant')),
+                      parallelism=step.get('max_inflight'))
+    if op == 'mix':
+        n = resolve_count(step.get('count', 'N'), count)
+        cmds, tgts = mix_cmds(step, n, ctx, state)
+        done, err = do_cmds(batch, cmds, count, ctx, opts,
+                            targets=tgts, **kwargs)
+    elif op == 'io':
+        done, err = run_io(step, count, ctx, opts, state, kwargs)
+    else:
+        cmdfmt, tgtfmt = OPS[op]
+        tgtfmt = step.get('name', tgtfmt)
+        if 'source' in step:
+            source = state[step['source']][0]
+            cmdfmt = cmdfmt.replace('{source}', source)
+        if tgtfmt is not None:
+            n = resolve_count(step.get('count', 'N'), count)
+            done, err = do_fmt(batch, cmdfmt, tgtfmt, count, ctx, opts,
+                               nexec=n, **kwargs)
+            if op == 'snapshot':
+                done = [source + "/" + snap for snap in done]
+        elif 'targets' in step:
+            names = list(state[step['targets']])
+            cmds = [cmdfmt.format(**target_fields(name)) for name in names]
+            done, err = do_cmds(batch, cmds, count, ctx, opts,
+                                targets=names, **kwargs)
+            if op in ('delete', 'delete-image'):
+                state[step['targets']] = [n for n in names if n not in done]
+        else:
+            n = resolve_count(step.get('count', 1), count)
+            done, err = do_cmds(batch, [cmdfmt] * n, count, ctx, opts,
+                                **kwargs)
+    if err:
+        raise Exception("error in {} batch".format(batch))
+
+    if step.get('ready') or step.get('wait_cloudinit'):
+        stages = ['network'] if step.get('ready') else []
+        if 'ubuntu' in opts.image:
+            stages.append('cloud-init')
+        ready = wait_ready(batch, done, started, count, ctx, opts, stages,
+                           record=step.get('ready', False))
+        if len(ready) < len(done):
+            raise Exception("containers of the {} batch did not become "
+                            "ready".format(batch))
+    if footprint and done:
+        record_footprint(batch, count, done, storage_base, ctx, opts)
+    if 'save' in step:
+        state.setdefault(step['save'], []).extend(done)
+    return done
+
+
+# a container's cgroup usage, see read_cgroup_usage. The simulated driver
+# reports what its stand-in containers hold.
+def container_usage(ctx, name):
+    if ctx.driver.name == 'simulated':
+        return ctx.driver.usage(name)
+    return read_cgroup_usage(name)
+
+
+# what the containers (or snapshots) a step created use: summed cgroup
+# usage of those that run, and how much the backend's storage grew
+def record_footprint(batch, count, names, storage_base, ctx, opts):
+    usage = [container_usage(ctx, name) for name in names if '/' not in name]
+    usage = [u for u in usage if u is not None]
+    used = storage_used(ctx, opts, names)
+    disk = None
+    if used is not None and storage_base is not None:
+        disk = used - storage_base
+    mem = cpu_time = io = None
+    if usage:
+        mem = sum(u['mem'] for u in usage)
+        cpu_time = sum(u['cpu_time'] for u in usage)
+        if all(u['io'] is not None for u in usage):
+            io = sum(u['io'] for u in usage)
+    dbc.execute("INSERT INTO footprints(run_id, backend, count, batch, "
+                "targets, cgroups, mem, cpu_time, io_bytes, disk) VALUES "
+                "(?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (run_id, ctx.backend, count, batch, len(names), len(usage),
+                 mem, cpu_time, io, disk))
+    db.commit()
 
 
-def run_bench(opts):
-    for backend in opts.backends.split(','):
-        print("* backend = {}".format(backend))
-        tmp_dir = mkdtemp(prefix=opts.run_dir + "lxd_tmp_")
-        call("chmod +x {}".format(tmp_dir), shell=True)
-        binfo = setup_backend(backend, tmp_dir, opts)
-        print("** check backend is set up:")
-        call("lxc finger --debug", shell=True)
-        import_image(opts.image)
+# "256M" -> 268435456
+def parse_size(size):
+    units = {'k': 2 ** 10, 'm': 2 ** 20, 'g': 2 ** 30}
+    size = str(size).lower().rstrip('b')
+    if size and size[-1] in units:
+        return int(float(size[:-1]) * units[size[-1]])
+    return int(size)
+
+
+# run an io workload in every target container at once, then record
+# MB/s, IOPS and latency per container. fio's own report is used where
+# it can be read back; otherwise, as for smallfiles, the numbers come
+# from the size of the job and the time lxc exec took.
+def run_io(step, count, ctx, opts, state, kwargs):
+    workload = step['workload']
+    batch = step.get('batch', 'io-' + workload)
+    names = list(state[step['targets']])
+    if not names:
+        return [], False
+    args, bs = IO_WORKLOADS[workload]
+    if args is None:
+        nfiles = step.get('files', 1000)
+        cmd = SMALLFILES_CMD.format(nfiles=nfiles)
+        nbytes, nios = 2 * nfiles, nfiles
+    else:
         try:
-            for count in opts.counts.split(','):
-                count = int(count)
-                print("** N = {}".format(count))
+            ctx.driver.run("lxc exec {} -- which fio".format(names[0]))
+        except CalledProcessError:
+            print("fio not found in {}, skipping {}".format(names[0], batch))
+            return [], False
+        size = step.get('size', '256M')
+        cmd = FIO_CMD.format(workload=workload, file=IO_FILE, size=size,
+                             bs=bs, args=args,
+                             runtime=step.get('runtime', 60))
+        nbytes = parse_size(size)
+        nios = nbytes // parse_size(bs)
+    if kwargs['parallelism'] is None:
+        kwargs = dict(kwargs, parallelism=len(names))
+    cmds = ["lxc exec {} -- {}".format(name, cmd) for name in names]
+    durations = {}
+    done, err = do_cmds(batch, cmds, count, ctx, opts, targets=names,
+                        durations=durations, **kwargs)
+
+    rows = []
+    for name in done:
+        dur = durations[name]
+        row = dict(bytes=nbytes, ios=nios, runtime=dur,
+                   mb_per_sec=nbytes / 2 ** 20 / dur, iops=nios / dur,
+                   lat_mean=dur / nios, lat_p99=None, source='wall')
+        if args is not None:
+            row.update(read_fio_result(ctx, name, workload))
+        rows.append((run_id, ctx.backend, count, batch, workload, name,
+                     row['bytes'], row['ios'], row['runtime'],
+                     row['mb_per_sec'], row['iops'], row['lat_mean'],
+                     row['lat_p99'], row['source']))
+    dbc.executemany("INSERT INTO io_results(run_id, backend, count, batch, "
+                    "workload, target, bytes, ios, runtime, mb_per_sec, "
+                    "iops, lat_mean, lat_p99, source) VALUES "
+                    "(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+    db.commit()
+    return done, err
+
+
+# fio's json report of one workload in one container, as io_results
+# fields, or {} if it can not be read or is not laid out as expected
+def read_fio_result(ctx, name, workload):
+    try:
+        out = ctx.driver.run("lxc exec {} -- cat "
+                             "/var/tmp/fio-{}.json".format(name, workload))
+        report = json.loads(out[out.index(b'{'):].decode())
+        job = report['jobs'][0]
+        io = job['read'] if 'read' in workload else job['write']
+        clat = io.get('clat_ns', {})
+        p99 = clat.get('percentile', {}).get('99.000000')
+        return dict(bytes=io['io_bytes'], ios=io['total_ios'],
+                    runtime=io['runtime'] / 1000.0,
+                    mb_per_sec=io['bw_bytes'] / 2 ** 20, iops=io['iops'],
+                    lat_mean=clat.get('mean', 0) / 1e9,
+                    lat_p99=p99 / 1e9 if p99 is not None else None,
+                    source='fio')
+    except (CalledProcessError, TypeError, ValueError, KeyError,
+            IndexError):
+        return {}
+
+
+# create a fixture's containers unless this count already has them
+def ensure_fixture(name, count, ctx, opts, state, scenario):
+    if state.get(name):
+        return
+    for step in scenario['fixtures'][name]:
+        if sigusr_received:
+            return
+        step = dict(step)
+        if step['op'] in ('launch', 'copy') and 'save' not in step:
+            step['save'] = name
+        run_step(step, count, ctx, opts, state, scenario)
+
+
+def run_phase(phase, count, ctx, opts, state, scenario):
+    for fixture in phase.get('uses', []):
+        ensure_fixture(fixture, count, ctx, opts, state, scenario)
+    for step in phase['steps']:
+        # later steps may need what a stopped batch did not make
+        if sigusr_received:
+            return
+        print("*** {} {}".format(phase['name'], step.get('batch',
+                                                          step['op'])))
+        run_step(step, count, ctx, opts, state, scenario)
 
-                print("*** launching {} containers".format(count))
-                launched, err = do_launch(count, backend, opts)
-                if err:
-                    raise Exception("error launching")
-                print("*** listing")
-                _, err = do_list(count, "containers", backend, opts)
-                if err:
-                    raise Exception("error listing")
-
-                print("*** deleting")
-                _, err = do_delete(launched, 'containers', count, backend, opts)
-                if err:
-                    raise Exception("error deleting")
-
-                launched, err = do_launch(1, backend, opts, record=False)
-                if len(launched) <= 0:
-                    raise Exception("error launching template for copy and snap")
-                src = launched[0]
-                if 'ubuntu' in opts.image:
-                    wait_for_cloudinit_done(src)
-                print("*** pausing " + src)
-                _, err = do_pause([src], count, backend, opts)
-                if err:
-                    raise Exception("error pausing")
-
-                print("*** making {} copies".format(count))
-                copies, err = do_copy(src, count, backend, opts)
-                if err:
-                    raise Exception("error copying")
-
-                _, err = do_list(count, "copies", backend, opts)
-                if err:
-                    raise Exception("error listing")
-
-                print("*** deleting the copies")
-                _, err = do_delete(copies, 'copies', count, backend, opts)
-                if err:
-                    raise Exception("error deleting copies")
-
-                print("*** making {} snapshots".format(count))
-                _, err = do_snapshot(src, count, backend, opts)
-                if err:
-                    raise Exception("error snapshotting")
-                print("*** cleaning up {} and snaps".format(src))
-                # deleting src will delete the snapshots too:
-                _, err = do_delete([src], 'container-with-snaps', count, backend,
-                                   opts)
-                if err:
-                    raise Exception("error deleting at end")
 
+# setup/startup/shutdown/teardown times of a backend's daemon
+def record_daemon_event(backend, event, duration):
+    dbc.execute("INSERT INTO daemon_events(run_id, backend, event, "
+                "duration, date) VALUES (?, ?, ?, ?, datetime('now'))",
+                (run_id, backend, event, duration))
+    db.commit()
+
+
+def get_progress(backend, count, phase):
+    dbc.execute("SELECT status FROM progress WHERE run_id = ? AND "
+                "backend = ? AND count = ? AND phase = ?",
+                (run_id, backend, count, phase))
+    row = dbc.fetchone()
+    return row[0] if row else None
+
+
+def set_progress(backend, count, phase, status):
+    dbc.execute("INSERT OR REPLACE INTO progress(run_id, backend, count, "
+                "phase, status, date) VALUES (?, ?, ?, ?, ?, datetime('now'))",
+                (run_id, backend, count, phase, status))
+    db.commit()
+
+
+# force-delete whatever containers are left so the next count starts clean
+def cleanup_containers(ctx):
+    if isinstance(ctx.driver, SimulatedDriver):
+        ctx.driver.reset()
+        return
+    names = ctx.sh("lxc list --format csv -c n")
+    for name in names.decode().split():
+        ctx.call("lxc delete -f " + name)
+
+
+@contextmanager
+def backend_up(backend, opts):
+    """Brings up LXD on a fresh backend, yields its BackendContext and
+    tears everything down again afterwards."""
+    tmp_dir = mkdtemp(prefix=opts.run_dir + "lxd_tmp_")
+    call("chmod +x {}".format(tmp_dir), shell=True)
+    ctx = BackendContext(backend, tmp_dir)
+    start = time.time()
+    setup_backend(ctx, opts)
+    add_span('setup', 'backend', start, time.time())
+    record_daemon_event(backend, 'setup', time.time() - start)
+    record_daemon_event(backend, 'startup', ctx.startup_time)
+    simulated = opts.driver == 'simulated'
+    if not simulated:
+        print("** check backend is set up:")
+        ctx.call("lxc finger --debug")
+        with span('import-image', 'backend', image=opts.image):
+            import_image(opts.image, ctx)
+    ctx.driver = DRIVERS[opts.driver](ctx, opts)
+    if opts.overhead_samples:
+        with span('measure-overhead', 'backend'):
+            overhead = measure_overhead(ctx, opts)
+        print("** harness overhead {:.2f} ms/op".format(1000 * overhead))
+        record_daemon_event(backend, 'harness-overhead', overhead)
+    try:
+        yield ctx
+    finally:
+        ctx.driver.close()
+        if not simulated:
+            with span('delete-image', 'backend'):
+                delete_image(ctx)
+        start = time.time()
+        shutdown_time = teardown_backend(ctx, opts)
+        add_span('teardown', 'backend', start, time.time())
+        save_spans(backend)
+        record_daemon_event(backend, 'teardown', time.time() - start)
+        record_daemon_event(backend, 'shutdown', shutdown_time)
+        if not opts.keep:
+            call("sudo rm -rf {}".format(tmp_dir), shell=True)
+
+
+def run_backend(backend, counts, scenario, opts):
+    phases = scenario['phases']
+    print("* backend = {}".format(backend))
+    if all(get_progress(backend, count, phase['name']) == 'done'
+           for count in counts for phase in phases):
+        print("** already done, skipping")
+        return
+    with backend_up(backend, opts) as ctx:
+        try:
+            for i, count in enumerate(counts):
+                print("** N = {}".format(count))
+                state = {}
+                for phase in phases:
+                    name = phase['name']
+                    if get_progress(backend, count, name) == 'done':
+                        print("*** {} already done, skipping".format(name))
+                        continue
+                    set_progress(backend, count, name, 'running')
+                    try:
+                        run_phase(phase, count, ctx, opts, state, scenario)
+                    except:
+                        set_progress(backend, count, name, 'failed')
+                        if opts.on_error != 'continue':
+                            raise
+                        print("Phase {} failed, cleaning up and moving "
+                              "on.".format(name))
+                        print(traceback.format_exc())
+                        cleanup_containers(ctx)
+                        break
+                    if sigusr_received:
+                        break
+                    set_progress(backend, count, name, 'done')
+
+                if sigusr_received:
+                    # every later batch would be skipped anyway, so leave
+                    # what is not done for a --resume
+                    for c in counts[i:]:
+                        for phase in phases:
+                            if get_progress(backend, c,
+                                            phase['name']) != 'done':
+                                set_progress(backend, c, phase['name'],
+                                             'stopped')
+                    print("*** stopped, cleaning up")
+                    cleanup_containers(ctx)
+                    break
                 print("*** check that we're clean:")
-                call("lxc list", shell=True)
+                if opts.driver == 'simulated':
+                    print(ctx.driver.names())
+                else:
+                    ctx.call("lxc list")
         except:
+            if opts.on_error == 'abort':
+                raise
             print("Stopped because of an error. Go clean me up, sorry.")
             print(traceback.format_exc())
-            print("try LXD_DIR={}/lxd_dir lxc list".format(tmp_dir))
+            print("try LXD_DIR={} lxc list".format(ctx.lxd_dir))
             input("done poking? ")
 
-        finally:
-            delete_image()
-            teardown_backend(backend, tmp_dir, binfo, opts)
-            if not opts.keep:
-                call("sudo rm -rf {}".format(tmp_dir), shell=True)
+
+# time commands that do nothing through the run's driver and engine, which
+# is what the harness itself adds to every measured duration
+def measure_overhead(ctx, opts):
+    engine = ENGINES[opts.engine](1, ctx.driver)
+    durs = []
+    try:
+        for i in range(opts.overhead_samples):
+            start, end = engine.submit(ctx.driver.noop_cmd).result()
+            durs.append(end - start)
+    finally:
+        engine.shutdown()
+    return float(np.median(durs))
+
+
+# worker process for --parallel-backends: own db connection, own cpus
+def backend_worker(backend, counts, scenario, opts, cpus):
+    if cpus:
+        os.sched_setaffinity(0, cpus)
+        print("* backend {} pinned to cpus {}".format(backend,
+                                                      sorted(cpus)))
+    # hold on to the connection inherited from the parent: closing it here
+    # would make sqlite treat the parent's WAL as ours to clean up
+    inherited = db  # noqa: F841
+    init_db()
+    try:
+        run_backend(backend, counts, scenario, opts)
+    finally:
+        db.commit()
+        db.close()
+
+
+# "0-3,8:4-7" -> [{0, 1, 2, 3, 8}, {4, 5, 6, 7}]
+def parse_cpusets(spec):
+    cpusets = []
+    for group in spec.split(':'):
+        cpus = set()
+        for part in group.split(','):
+            if '-' in part:
+                lo, hi = part.split('-')
+                cpus.update(range(int(lo), int(hi) + 1))
+            else:
+                cpus.add(int(part))
+        cpusets.append(cpus)
+    return cpusets
+
+
+def run_bench(opts, scenario):
+    if opts.counts is not None:
+        counts = [int(count) for count in opts.counts.split(',')]
+    else:
+        counts = scenario['counts']
+    backends = opts.backends.split(',')
+    if not opts.parallel_backends:
+        for backend in backends:
+            if sigusr_received:
+                print("* skipping {}, stopped".format(backend))
+                continue
+            run_backend(backend, counts, scenario, opts)
+        return
+
+    cpusets = parse_cpusets(opts.cpusets) if opts.cpusets else []
+    # nobody can answer a prompt from several workers at once
+    if opts.on_error == 'prompt':
+        opts.on_error = 'abort'
+    db.commit()
+    mp = multiprocessing.get_context('fork')
+    procs = []
+    for i, backend in enumerate(backends):
+        cpus = cpusets[i % len(cpusets)] if cpusets else None
+        proc = mp.Process(target=backend_worker, name=backend,
+                          args=(backend, counts, scenario, opts, cpus))
+        proc.start()
+        procs.append(proc)
+
+    def forward_sigusr1(signum, frame):
+        handle_sigusr1(signum, frame)
+        for proc in procs:
+            if proc.is_alive():
+                os.kill(proc.pid, signal.SIGUSR1)
+
+    signal.signal(signal.SIGUSR1, forward_sigusr1)
+    failed = []
+    for proc in procs:
+        proc.join()
+        if proc.exitcode != 0:
+            failed.append(proc.name)
+    if failed:
+        raise Exception("backend workers failed: " + ", ".join(failed))
+
+
+# the first SLO the host breaks after a capacity step, with the free +
+# cached memory (MB) and load it was checked at
+def slo_violation(p95, opts):
+    mem = read_meminfo()
+    avail = (mem['MemFree'] + mem['Buffers'] + mem['Cached']) // 1024
+    load = get_load()
+    violated = None
+    if p95 is not None and p95 > opts.slo_p95:
+        violated = 'p95 launch latency'
+    elif avail < opts.slo_mem:
+        violated = 'memory'
+    elif load > opts.slo_load:
+        violated = 'load'
+    return violated, avail, load
+
+
+def run_capacity(backend, opts):
+    """Ramp up launches on one backend until an SLO breaks.
+
+    Each step launches 'step' more containers as one batch, waits
+    --settle seconds and checks the batch's p95 launch latency, free +
+    cached memory and load against the SLOs. While they hold the step
+    doubles. When one breaks, that step's containers are deleted again
+    and the ramp goes on from the last good count with half the step,
+    bisecting the gap to the smallest count known to break. It ends once
+    the gap is down to --min-step, or at --max-count.
+    """
+    print("* backend = {}".format(backend))
+    with backend_up(backend, opts) as ctx:
+        launched = []
+        good = 0
+        ceiling = None
+        limit = None
+        step = opts.step
+        nnames = 0
+        last = (None, None, None)
+        while not sigusr_received:
+            step = min(step, opts.max_count - good)
+            if step < 1:
+                limit = 'max count'
+                break
+            names = ['cap-{}-{}'.format(nnames + i, backend)
+                     for i in range(step)]
+            nnames += step
+            total = good + step
+            durations = {}
+            cmds = [OPS['launch'][0].format(target=name) for name in names]
+            done, err = do_cmds('capacity-launch', cmds, total, ctx, opts,
+                                targets=names, durations=durations)
+            launched.extend(done)
+            p95 = None
+            if durations:
+                p95 = float(np.percentile(list(durations.values()), 95))
+            time.sleep(opts.settle)
+            violated, avail, load = slo_violation(p95, opts)
+            if err:
+                violated = 'launch error'
+            elif len(done) < step and violated is None:
+                # do_cmds hit --mem-threshold or --runtime-threshold
+                violated = 'harness threshold'
+            dbc.execute("INSERT INTO capacity_steps(run_id, backend, count, "
+                        "step, p95, mem_avail, load, violated) VALUES "
+                        "(?, ?, ?, ?, ?, ?, ?, ?)",
+                        (run_id, backend, total, step, p95, avail, load,
+                         violated))
+            db.commit()
+            print("** {} containers: p95 {}, {} MB available, load "
+                  "{:.2f} {}".format(total, p95, avail, load,
+                                     violated or 'ok'))
+
+            if violated is None:
+                good = total
+                last = (p95, avail, load)
+                if ceiling is None:
+                    step *= 2
+                elif ceiling - good <= opts.min_step:
+                    break
+                else:
+                    step = max(opts.min_step, (ceiling - good) // 2)
+                continue
+
+            limit = violated
+            ceiling = total
+            if step <= opts.min_step or sigusr_received:
+                break
+            # back off to the last good count and bisect the gap
+            extra = launched[good:]
+            do_cmds('capacity-delete',
+                    [OPS['delete'][0].format(target=name) for name in extra],
+                    good, ctx, opts, targets=extra, record=False)
+            del launched[good:]
+            step = max(opts.min_step, step // 2)
+
+        if sigusr_received and limit is None:
+            limit = 'stopped'
+        dbc.execute("INSERT INTO capacity(run_id, backend, max_count, "
+                    "limit_by, ceiling, p95, mem_avail, load, date) VALUES "
+                    "(?, ?, ?, ?, ?, ?, ?, ?, datetime('now'))",
+                    (run_id, backend, good, limit, ceiling) + last)
+        db.commit()
+        print("** {} sustains {} containers, limited by {}".format(
+            backend, good, limit))
+        cleanup_containers(ctx)
+
+
+def show_capacity(the_id, fmt):
+    dbc.execute("SELECT backend, max_count, limit_by, ceiling, p95, "
+                "mem_avail, load FROM capacity WHERE run_id = ? "
+                "ORDER BY backend", (the_id, ))
+    rows = dbc.fetchall()
+    if not rows:
+        return
+    print("\n")
+    print(tabulate.tabulate(rows, headers=['backend', 'max_count',
+                                           'limited_by', 'fails_at',
+                                           'p95', 'mem_avail', 'load'],
+                            tablefmt=fmt, floatfmt='.3g'))
 
 
-def show_report(the_id, csv=False, showall=False):
-    dbc.execute("SELECT * FROM runs where id = ?", (the_id, ))
+def show_report(the_id, csv=False, showall=False, stats=False, nboot=1000,
+                confidence=0.95, subtract_overhead=False, from_hist=False):
+    dbc.execute("SELECT id, argv, date, message FROM runs where id = ?",
+                (the_id, ))
     run_rows = dbc.fetchall()
     print(tabulate.tabulate(run_rows))
-    dbc.execute("SELECT * FROM timings WHERE run_id = {} "
-                "ORDER BY batch, count, numrecs".format(the_id))
+    dbc.execute("SELECT id, batch, backend, numrecs, count, total_time, "
+                "avg_time, mem_increase, load_increase, disk_increase, "
+                "image, run_id, parallelism, ops_per_sec, driver, "
+                "lxd_rss_increase, lxd_cpu_time, helpers_rss, status, "
+                "offered_rate FROM timings WHERE run_id = {} "
+                "ORDER BY batch, count, numrecs, id".format(the_id))
     rows = dbc.fetchall()
     headers = ['id', 'batch', 'backend', 'numrecs', 'count',
                'total_time', 'avg_time', 'mem_inc', 'load_inc', 'disk_inc',
-               'image', 'runid']
+               'image', 'runid', 'parallel', 'ops/s', 'driver', 'lxd_rss_inc',
+               'lxd_cpu', 'helper_rss', 'status', 'rate']
     if csv:
         fmt = tabulate.simple_separated_format(",")
     else:
@@ -484,17 +2644,750 @@ def show_report(the_id, csv=False, showall=False):
     if not showall:
         print(tabulate.tabulate(rows, headers=headers, tablefmt=fmt,
                                 floatfmt='.3g'))
+        show_daemon_cost(the_id, fmt)
+        show_io(the_id, fmt)
+        show_footprint(the_id, fmt)
+        show_probes(the_id, fmt)
+        show_capacity(the_id, fmt)
+        show_daemon_events(the_id, fmt)
+        if stats:
+            show_stats(the_id, fmt, nboot, confidence, subtract_overhead,
+                       from_hist)
         return
 
+    # every batch's recs from one query, in the order of the batches.
+    # Batches without recs, from --no-recs runs or stopped before any
+    # command finished, have no group and get an empty table.
+    dbc.execute("SELECT r.id, r.cmd, r.duration, r.timings_id, r.started, "
+                "r.queue_delay FROM recs r JOIN timings t "
+                "ON r.timings_id = t.id WHERE t.run_id = ? "
+                "ORDER BY t.batch, t.count, t.numrecs, t.id, r.id",
+                (the_id, ))
+    recs = itertools.groupby(dbc, key=lambda rec: rec[3])
+    group = next(recs, None)
     for row in rows:
         print("\n\n")
-        print(tabulate.tabulate([row], headers=headers, tablefmt=fmt,
-                                floatfmt='.3g'))
-        id = row[0]
-        dbc.execute("SELECT * FROM recs WHERE timings_id = ?", (id,))
+        print(tabulate.tabulate([row], headers=headers,
+                                tablefmt=fmt, floatfmt='.3g'))
         print("\n")
-        print(tabulate.tabulate(dbc.fetchall(), headers=['cmd', 'dur', 'id'],
+        matched = group is not None and group[0] == row[0]
+        print(tabulate.tabulate(group[1] if matched else [],
+                                headers=['id', 'cmd', 'dur', 'timings_id',
+                                         'started', 'queued'],
                                 floatfmt='.3g'))
+        if matched:
+            group = next(recs, None)
+
+
+# io workloads per backend: throughput and IOPS summed over the
+# containers running at once, latency averaged and worst p99
+def show_io(the_id, fmt):
+    dbc.execute("SELECT backend, workload, count, count(*), "
+                "sum(mb_per_sec), avg(mb_per_sec), sum(iops), "
+                "avg(lat_mean), max(lat_p99), group_concat(DISTINCT source) "
+                "FROM io_results WHERE run_id = ? "
+                "GROUP BY backend, batch, workload, count "
+                "ORDER BY workload, count, backend", (the_id, ))
+    rows = dbc.fetchall()
+    if not rows:
+        return
+    print("\n")
+    print(tabulate.tabulate(rows, headers=['backend', 'workload', 'count',
+                                           'ctrs', 'MB/s', 'MB/s/ctr',
+                                           'iops', 'lat', 'lat_p99',
+                                           'from'],
+                            tablefmt=fmt, floatfmt='.3g'))
+
+
+# per container memory, cpu and io from the cgroups of those created by
+# each batch, and the storage they added to the backend's pool
+def show_footprint(the_id, fmt):
+    dbc.execute("SELECT backend, batch, count, targets, "
+                "mem * 1.0 / cgroups / 1048576, cpu_time / cgroups, "
+                "io_bytes * 1.0 / cgroups / 1048576, "
+                "disk * 1.0 / targets / 1048576 FROM footprints "
+                "WHERE run_id = ? ORDER BY batch, count, backend",
+                (the_id, ))
+    rows = dbc.fetchall()
+    if not rows:
+        return
+    print("\n")
+    print(tabulate.tabulate(rows, headers=['backend', 'batch', 'count',
+                                           'targets', 'mem_MB/ctr',
+                                           'cpu_s/ctr', 'io_MB/ctr',
+                                           'disk_MB/ctr'],
+                            tablefmt=fmt, floatfmt='.3g'))
+
+
+# latency of the background list and info queries of each batch, by how
+# many containers there were when they were made: the range from fewest
+# to most is cut into PROBE_BINS equal parts
+PROBE_BINS = 4
+
+
+def show_probes(the_id, fmt):
+    dbc.execute("SELECT t.backend, t.batch, t.count, p.query, "
+                "p.containers, p.duration, p.ok FROM probes p "
+                "JOIN timings t ON p.timings_id = t.id WHERE t.run_id = ? "
+                "ORDER BY t.batch, t.count, t.backend, p.query",
+                (the_id, ))
+    rows = []
+    for key, probes in itertools.groupby(dbc.fetchall(),
+                                         key=lambda p: p[:4]):
+        probes = list(probes)
+        # lists that failed before any succeeded have no count to go by
+        unknown = sum(1 for p in probes if p[4] is None)
+        if unknown:
+            rows.append(key + ('?', 0, None, None, unknown))
+        probes = [p for p in probes if p[4] is not None]
+        if not probes:
+            continue
+        ctrs, durs, oks = (np.array(c) for c in zip(*[p[4:] for p in probes]))
+        edges = np.linspace(ctrs.min(), ctrs.max() + 1, PROBE_BINS + 1)
+        bins = np.digitize(ctrs, edges[1:-1])
+        for i in range(PROBE_BINS):
+            sel = (bins == i) & (oks == 1)
+            nfail = int(((bins == i) & (oks == 0)).sum())
+            if not sel.any() and not nfail:
+                continue
+            med = p95 = None
+            if sel.any():
+                med, p95 = np.percentile(durs[sel], [50, 95])
+            rows.append(key + ("{}-{}".format(int(ctrs[bins == i].min()),
+                                              int(ctrs[bins == i].max())),
+                               int(sel.sum()), med, p95, nfail))
+    if not rows:
+        return
+    print("\n")
+    print(tabulate.tabulate(rows, headers=['backend', 'batch', 'count',
+                                           'query', 'ctrs', 'probes',
+                                           'median', 'p95', 'failed'],
+                            tablefmt=fmt, floatfmt='.3g'))
+
+
+# lxd memory growth and cpu time divided over the ops in each batch
+def show_daemon_cost(the_id, fmt):
+    dbc.execute("SELECT backend, batch, count, numrecs, "
+                "lxd_rss_increase * 1.0 / numrecs, lxd_cpu_time / numrecs, "
+                "helpers_rss FROM timings "
+                "WHERE run_id = ? AND lxd_cpu_time IS NOT NULL "
+                "ORDER BY backend, batch, count", (the_id, ))
+    rows = dbc.fetchall()
+    if not rows:
+        return
+    print("\n")
+    print(tabulate.tabulate(rows, headers=['backend', 'batch', 'count',
+                                           'numrecs', 'lxd_kB/op',
+                                           'lxd_cpu_s/op', 'helper_rss'],
+                            tablefmt=fmt, floatfmt='.3g'))
+
+
+# upper bound on elements in one block of bootstrap resamples
+BOOTSTRAP_BLOCK = 2 ** 22
+
+
+def bootstrap_ci(values, stat, nboot, confidence, rng):
+    """Percentile bootstrap interval for stat(values).
+
+    stat must accept an axis argument; resamples are drawn and reduced a
+    block at a time so nboot x len(values) never has to fit in memory.
+    """
+    n = len(values)
+    block = max(1, BOOTSTRAP_BLOCK // n)
+    estimates = []
+    for done in range(0, nboot, block):
+        idx = rng.integers(0, n, size=(min(block, nboot - done), n))
+        estimates.append(stat(values[idx], axis=1))
+    alpha = (1 - confidence) / 2
+    return np.quantile(np.concatenate(estimates), [alpha, 1 - alpha])
+
+
+def p99(values, axis=None):
+    return np.percentile(values, 99, axis=axis)
+
+
+def latency_stats(durs, nboot=1000, confidence=0.95, rng=None):
+    if rng is None:
+        rng = np.random.default_rng(0)
+    p50, p90, p99_ = np.percentile(durs, [50, 90, 99])
+    mean_lo, mean_hi = bootstrap_ci(durs, np.mean, nboot, confidence, rng)
+    p99_lo, p99_hi = bootstrap_ci(durs, p99, nboot, confidence, rng)
+    return dict(n=len(durs), mean=durs.mean(), mean_lo=mean_lo,
+                mean_hi=mean_hi, p50=p50, p90=p90, p99=p99_, p99_lo=p99_lo,
+                p99_hi=p99_hi, max=durs.max(),
+                std=durs.std(ddof=1) if len(durs) > 1 else 0.0)
+
+
+# returns {timings_id: array of durations} for every batch in a run,
+# from one query over recs. durations are in the order the commands were
+# started.
+def load_durations(the_id):
+    dbc.execute("SELECT timings_id, duration FROM recs WHERE timings_id IN "
+                "(SELECT id FROM timings WHERE run_id = ?) "
+                "ORDER BY timings_id, started, id", (the_id, ))
+    data = np.array(dbc.fetchall(), dtype=float).reshape(-1, 2)
+    if not len(data):
+        return {}
+    ids = data[:, 0].astype(int)
+    bounds = np.flatnonzero(np.diff(ids)) + 1
+    groups = np.split(data[:, 1], bounds)
+    return dict(zip(ids[np.r_[0, bounds]].tolist(), groups))
+
+
+# like load_durations, but each batch's durations recovered from its
+# histogram (bucket midpoints, in sorted order). Works for runs stored
+# with --no-recs.
+def load_hist_durations(the_id):
+    dbc.execute("SELECT id, hist FROM timings WHERE run_id = ? AND "
+                "hist IS NOT NULL", (the_id, ))
+    durations = {}
+    for tid, blob in dbc.fetchall():
+        hist = Histogram.from_blob(blob)
+        if hist.total():
+            durations[tid] = hist.values()
+    return durations
+
+
+# durations from recs where there are any, from histograms for batches
+# without, or only from histograms
+def load_batch_durations(the_id, from_hist=False):
+    if from_hist:
+        return load_hist_durations(the_id)
+    durations = load_hist_durations(the_id)
+    durations.update(load_durations(the_id))
+    return durations
+
+
+STATS_HEADERS = ['n', 'mean', 'mean_lo', 'mean_hi', 'p50', 'p90', 'p99',
+                 'p99_lo', 'p99_hi', 'max', 'std']
+
+
+# median harness overhead per op measured for each backend of a run
+def load_overhead(the_id):
+    dbc.execute("SELECT backend, duration FROM daemon_events "
+                "WHERE run_id = ? AND event = 'harness-overhead'", (the_id, ))
+    overhead = {}
+    for backend, duration in dbc.fetchall():
+        overhead.setdefault(backend, []).append(duration)
+    return {b: float(np.median(d)) for b, d in overhead.items()}
+
+
+def show_stats(the_id, fmt, nboot=1000, confidence=0.95,
+               subtract_overhead=False, from_hist=False):
+    durations = load_batch_durations(the_id, from_hist)
+    overhead = load_overhead(the_id) if subtract_overhead else {}
+    dbc.execute("SELECT id, backend, batch, count FROM timings "
+                "WHERE run_id = ? ORDER BY backend, batch, count",
+                (the_id, ))
+    rows = []
+    for tid, backend, batch, count in dbc.fetchall():
+        if tid not in durations:
+            continue
+        durs = durations[tid]
+        if backend in overhead:
+            durs = np.maximum(durs - overhead[backend], 0.0)
+        st = latency_stats(durs, nboot, confidence)
+        rows.append([backend, batch, count] +
+                    [st[h] for h in STATS_HEADERS])
+    print("\n")
+    if overhead:
+        print("less harness overhead of " +
+              ", ".join("{:.2f} ms/op on {}".format(1000 * o, b)
+                        for b, o in sorted(overhead.items())))
+    print(tabulate.tabulate(rows,
+                            headers=['backend', 'batch', 'count'] +
+                            STATS_HEADERS,
+                            tablefmt=fmt, floatfmt='.3g'))
+
+
+# ranks 1..n with ties given their average rank
+def rankdata(x):
+    order = np.argsort(x, kind='mergesort')
+    _, inv, counts = np.unique(x[order], return_inverse=True,
+                               return_counts=True)
+    avg = np.cumsum(counts) - (counts - 1) / 2.0
+    ranks = np.empty(len(x))
+    ranks[order] = avg[inv]
+    return ranks
+
+
+def mann_whitney(a, b):
+    """Two-sided Mann-Whitney U test p-value.
+
+    Uses the normal approximation with tie and continuity corrections,
+    which is fine for the batch sizes we run.
+    """
+    n1, n2 = len(a), len(b)
+    n = n1 + n2
+    both = np.concatenate([a, b])
+    u1 = rankdata(both)[:n1].sum() - n1 * (n1 + 1) / 2.0
+    _, counts = np.unique(both, return_counts=True)
+    ties = (counts ** 3 - counts).sum()
+    var = n1 * n2 / 12.0 * ((n + 1) - ties / (n * (n - 1)))
+    if var <= 0:
+        return 1.0
+    diff = u1 - n1 * n2 / 2.0
+    z = (abs(diff) - 0.5) / math.sqrt(var)
+    return min(1.0, math.erfc(max(z, 0) / math.sqrt(2)))
+
+
+# bootstrap interval for stat(b) / stat(a) - 1
+def bootstrap_change_ci(a, b, stat, nboot, confidence, rng):
+    block = max(1, BOOTSTRAP_BLOCK // max(len(a), len(b)))
+    estimates = []
+    for done in range(0, nboot, block):
+        k = min(block, nboot - done)
+        ea = stat(a[rng.integers(0, len(a), size=(k, len(a)))], axis=1)
+        eb = stat(b[rng.integers(0, len(b), size=(k, len(b)))], axis=1)
+        estimates.append(eb / ea - 1)
+    alpha = (1 - confidence) / 2
+    return np.quantile(np.concatenate(estimates), [alpha, 1 - alpha])
+
+
+COMPARE_STATS = {'mean': np.mean,
+                 'median': np.median,
+                 'p90': lambda v, axis=None: np.percentile(v, 90, axis=axis),
+                 'p99': p99}
+
+
+# returns {(backend, batch, count): durations} with repeated batches of
+# the same shape in a run pooled together
+# durations of a run's complete batches by (backend, batch, count, rate),
+# rate being the offered rate of an open loop batch or 0 for closed loop
+def load_keyed_durations(the_id, from_hist=False):
+    durations = load_batch_durations(the_id, from_hist)
+    dbc.execute("SELECT id, backend, batch, count, coalesce(offered_rate, 0) "
+                "FROM timings "
+                "WHERE run_id = ? AND (status IS NULL OR status = 'complete')",
+                (the_id, ))
+    keyed = {}
+    for tid, backend, batch, count, rate in dbc.fetchall():
+        if tid in durations:
+            keyed.setdefault((backend, batch, count, rate), []).append(
+                durations[tid])
+    return {k: np.concatenate(v) for k, v in keyed.items()}
+
+
+def compare_runs(run_a, run_b, stat='median', alpha=0.05, threshold=0.05,
+                 nboot=1000, confidence=0.95, csv=False, from_hist=False):
+    """Print per-batch changes from run_a to run_b.
+
+    A batch regresses when the Mann-Whitney test is significant at alpha
+    and the whole confidence interval of the relative change in 'stat' is
+    above 'threshold'. Returns the number of regressions.
+    """
+    durs_a = load_keyed_durations(run_a, from_hist)
+    durs_b = load_keyed_durations(run_b, from_hist)
+    statf = COMPARE_STATS[stat]
+    rng = np.random.default_rng(0)
+    rows = []
+    regressions = 0
+    for key in sorted(set(durs_a) & set(durs_b)):
+        a, b = durs_a[key], durs_b[key]
+        sa, sb = statf(a), statf(b)
+        lo, hi = bootstrap_change_ci(a, b, statf, nboot, confidence, rng)
+        p = mann_whitney(a, b) if len(a) > 1 and len(b) > 1 else float('nan')
+        verdict = ''
+        if p < alpha and lo > threshold:
+            verdict = 'REGRESSION'
+            regressions += 1
+        elif p < alpha and hi < -threshold:
+            verdict = 'improvement'
+        rows.append(list(key[:3]) + [key[3] or ''] + [len(a), len(b), sa, sb,
+                                 100 * (sb / sa - 1), 100 * lo, 100 * hi, p,
+                                 verdict])
+
+    for key in sorted(set(durs_a) ^ set(durs_b)):
+        print("only in run {}: {}".format(run_a if key in durs_a else run_b,
+                                         ' '.join(str(k) for k in key)))
+
+    if csv:
+        fmt = tabulate.simple_separated_format(",")
+    else:
+        fmt = 'simple'
+    print(tabulate.tabulate(rows,
+                            headers=['backend', 'batch', 'count', 'rate',
+                                     'n_a', 'n_b', stat + '_a', stat + '_b',
+                                     'change%', 'lo%', 'hi%', 'p', ''],
+                            tablefmt=fmt, floatfmt='.3g'))
+    return regressions
+
+
+# least squares fit returning coefficients and their standard errors
+def ols(X, y):
+    beta, _, _, _ = np.linalg.lstsq(X, y, rcond=None)
+    dof = len(y) - X.shape[1]
+    resid = y - X @ beta
+    sigma2 = resid @ resid / dof if dof > 0 else 0.0
+    cov = sigma2 * np.linalg.pinv(X.T @ X)
+    return beta, np.sqrt(np.maximum(np.diag(cov), 0))
+
+
+def coef_p(beta, se):
+    if se == 0:
+        return 0.0 if beta != 0 else 1.0
+    return math.erfc(abs(beta / se) / math.sqrt(2))
+
+
+def fit_growth(x, y, alpha=0.05):
+    """Classify how latency y grows with x.
+
+    Fits y = a + b*x and y = a + b*x + c*x^2. Growth is 'constant' unless
+    the slope is significant, 'superlinear' when the quadratic term is
+    significantly positive too, and 'linear' otherwise. Returns
+    (kind, slope per unit x, relative growth over the range of x, p).
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    span = x.max() - x.min()
+    if len(y) < 3 or span == 0:
+        return 'n/a', float('nan'), float('nan'), float('nan')
+
+    # fit on x scaled to [0, 1] so x^2 stays well conditioned
+    u = (x - x.min()) / span
+    beta, se = ols(np.column_stack([np.ones(len(u)), u]), y)
+    p = coef_p(beta[1], se[1])
+    slope = beta[1] / span
+    growth = beta[1] / beta[0] if beta[0] > 0 else float('nan')
+
+    if p >= alpha:
+        kind = 'constant'
+    elif beta[1] < 0:
+        kind = 'decreasing'
+    else:
+        kind = 'linear'
+        if len(np.unique(u)) > 2:
+            beta2, se2 = ols(np.column_stack([np.ones(len(u)), u, u ** 2]),
+                             y)
+            if beta2[2] > 0 and coef_p(beta2[2], se2[2]) < alpha:
+                kind = 'superlinear'
+    return kind, slope, growth, p
+
+
+def show_scaling(the_id, alpha=0.05, degrade=0.25, csv=False):
+    """Fit per-op latency against container density.
+
+    Within a batch, latency is fit against the number of containers that
+    existed when each command started (its index for launches and copies,
+    what is left for deletes). Across the counts sweep, every rec of a
+    (backend, batch) is fit against the batch's N. Rows whose growth is
+    linear or worse and adds more than 'degrade' over the range are
+    flagged.
+    """
+    durations = load_durations(the_id)
+    dbc.execute("SELECT id, backend, batch, count FROM timings "
+                "WHERE run_id = ? ORDER BY backend, batch, count",
+                (the_id, ))
+    timings = dbc.fetchall()
+    if csv:
+        fmt = tabulate.simple_separated_format(",")
+    else:
+        fmt = 'simple'
+
+    def flag(kind, growth):
+        if kind in ('linear', 'superlinear') and growth > degrade:
+            return 'DEGRADES'
+        return ''
+
+    rows = []
+    sweep = {}
+    for tid, backend, batch, count in timings:
+        if tid not in durations:
+            continue
+        durs = durations[tid]
+        sweep.setdefault((backend, batch), []).append((count, durs))
+        idx = np.arange(len(durs))
+        if batch.startswith('delete'):
+            idx = len(durs) - idx
+        kind, slope, growth, p = fit_growth(idx, durs, alpha)
+        if kind == 'n/a':
+            continue
+        rows.append([backend, batch, count, len(durs), kind, 1000 * slope,
+                     100 * growth, p, flag(kind, growth)])
+    print("\nper-op latency vs containers present, within each batch:")
+    print(tabulate.tabulate(rows, headers=['backend', 'batch', 'count', 'n',
+                                           'growth', 'ms/ctr', 'growth%',
+                                           'p', ''],
+                            tablefmt=fmt, floatfmt='.3g'))
+
+    rows = []
+    for (backend, batch), points in sorted(sweep.items()):
+        x = np.concatenate([np.full(len(d), c) for c, d in points])
+        y = np.concatenate([d for _, d in points])
+        kind, slope, growth, p = fit_growth(x, y, alpha)
+        if kind == 'n/a':
+            continue
+        counts = ','.join(str(c) for c in sorted(set(c for c, _ in points)))
+        rows.append([backend, batch, counts, kind, 1000 * slope,
+                     100 * growth, p, flag(kind, growth)])
+    print("\nper-op latency vs N across the counts sweep:")
+    print(tabulate.tabulate(rows, headers=['backend', 'batch', 'counts',
+                                           'growth', 'ms/N', 'growth%', 'p',
+                                           ''],
+                            tablefmt=fmt, floatfmt='.3g'))
+
+
+def show_knee(the_id, saturation=0.9, csv=False):
+    """Report how each open loop rate sweep kept up with its offered rate.
+
+    Achieved throughput is taken over the span of completions, so a batch
+    that keeps up finishes about as spread out as it was issued. A rate is
+    saturated when that falls under 'saturation' times the rate its
+    schedule really offered (a Poisson schedule's gaps only average out
+    to the nominal rate) or commands spend longer queued than being
+    served; the knee is the highest rate below the first saturated one.
+    """
+    dbc.execute("SELECT id, backend, batch, count, offered_rate, "
+                "coalesce(scheduled_rate, offered_rate) FROM timings "
+                "WHERE run_id = ? AND offered_rate IS NOT NULL "
+                "ORDER BY backend, batch, count, offered_rate", (the_id, ))
+    timings = dbc.fetchall()
+    if csv:
+        fmt = tabulate.simple_separated_format(",")
+    else:
+        fmt = 'simple'
+
+    rows = []
+    knees = {}
+    for tid, backend, batch, count, rate, offered in timings:
+        dbc.execute("SELECT started, duration, queue_delay FROM recs "
+                    "WHERE timings_id = ?", (tid, ))
+        recs = np.array(dbc.fetchall(), dtype=float).reshape(-1, 3)
+        if len(recs) < 2:
+            continue
+        ends = recs[:, 0] + recs[:, 1]
+        span = ends.max() - ends.min()
+        achieved = (len(recs) - 1) / span if span > 0 else float('inf')
+        service = recs[:, 1].mean()
+        queued = np.nan_to_num(recs[:, 2]).mean()
+        response = np.percentile(recs[:, 1] + np.nan_to_num(recs[:, 2]), 95)
+        saturated = achieved < saturation * offered or queued > service
+        rows.append([backend, batch, count, rate, offered, achieved, service,
+                     queued, response, 'SATURATED' if saturated else ''])
+
+        key = (backend, batch, count)
+        knee = knees.setdefault(key, [None, False, 0.0])
+        knee[2] = max(knee[2], min(achieved, offered))
+        if saturated:
+            knee[1] = True
+        elif not knee[1]:
+            knee[0] = rate
+
+    print(tabulate.tabulate(rows, headers=['backend', 'batch', 'count',
+                                           'rate/s', 'offered/s',
+                                           'achieved/s', 'service',
+                                           'queued', 'p95_resp', ''],
+                            tablefmt=fmt, floatfmt='.3g'))
+    print("\n")
+    print(tabulate.tabulate([list(k) + v[:1] + v[2:]
+                             for k, v in sorted(knees.items())],
+                            headers=['backend', 'batch', 'count', 'knee/s',
+                                     'max_achieved/s'],
+                            tablefmt=fmt, floatfmt='.3g'))
+
+
+def show_percentiles(run_ids, percentiles, csv=False):
+    """Percentiles from the histograms of the given runs' batches, merged
+    over every batch with the same backend, batch name, count and offered
+    rate (0 for closed loop)."""
+    dbc.execute("SELECT backend, batch, count, coalesce(offered_rate, 0), "
+                "hist FROM timings "
+                "WHERE run_id IN ({}) AND hist IS NOT NULL AND "
+                "(status IS NULL OR status = 'complete')".format(
+                    ','.join('?' * len(run_ids))), run_ids)
+    merged = {}
+    nbatches = {}
+    for backend, batch, count, rate, blob in dbc:
+        key = (backend, batch, count, rate)
+        hist = Histogram.from_blob(blob)
+        if key in merged:
+            merged[key].merge(hist)
+        else:
+            merged[key] = hist
+        nbatches[key] = nbatches.get(key, 0) + 1
+    if csv:
+        fmt = tabulate.simple_separated_format(",")
+    else:
+        fmt = 'simple'
+    rows = [list(key[:3]) + [key[3] or '', nbatches[key], hist.total()] +
+            list(hist.percentile(percentiles))
+            for key, hist in sorted(merged.items()) if hist.total()]
+    print(tabulate.tabulate(rows,
+                            headers=['backend', 'batch', 'count', 'rate',
+                                     'batches', 'n'] + ['p{:g}'.format(p)
+                                             for p in percentiles],
+                            tablefmt=fmt, floatfmt='.3g'))
+
+
+def show_daemon_events(the_id, fmt):
+    dbc.execute("SELECT backend, event, duration FROM daemon_events "
+                "WHERE run_id = ? ORDER BY backend, id", (the_id, ))
+    rows = dbc.fetchall()
+    if not rows:
+        return
+    print("\n")
+    print(tabulate.tabulate(rows, headers=['backend', 'event', 'sec'],
+                            tablefmt=fmt, floatfmt='.3g'))
+
+
+def export_trace(the_id, out):
+    """Write a run's spans as Chrome trace events (chrome://tracing,
+    Perfetto).
+
+    Each backend is a process and each thread a track; sampler spans
+    also become host memory, load and cpu counters. Events are streamed
+    from the query, so the run never has to fit in memory.
+    """
+    dbc.execute("SELECT min(start) FROM spans WHERE run_id = ?", (the_id, ))
+    t0 = dbc.fetchone()[0]
+    if t0 is None:
+        print("No trace spans recorded for run {}.".format(the_id),
+              file=sys.stderr)
+        return False
+
+    pids = {}
+    tids = {}
+    out.write('{"displayTimeUnit": "ms", "traceEvents": [\n')
+    first = True
+
+    def emit(event):
+        nonlocal first
+        if not first:
+            out.write(',\n')
+        first = False
+        out.write(json.dumps(event))
+
+    cur = db.cursor()
+    cur.execute("SELECT backend, name, cat, thread, start, dur, args "
+                "FROM spans WHERE run_id = ? ORDER BY start", (the_id, ))
+    for backend, name, cat, thread, start, dur, args in cur:
+        if backend not in pids:
+            pids[backend] = len(pids) + 1
+            emit(dict(ph='M', name='process_name', pid=pids[backend],
+                      args=dict(name=backend)))
+        pid = pids[backend]
+        if (pid, thread) not in tids:
+            tids[(pid, thread)] = len(tids) + 1
+            emit(dict(ph='M', name='thread_name', pid=pid,
+                      tid=tids[(pid, thread)], args=dict(name=thread)))
+        ts = (start - t0) * 1e6
+        args = json.loads(args) if args else {}
+        emit(dict(ph='X', name=args.get('cmd', name), cat=cat, pid=pid,
+                  tid=tids[(pid, thread)], ts=ts, dur=dur * 1e6, args=args))
+        if name == 'sample':
+            for key in ('mem_free', 'load', 'cpu_busy'):
+                emit(dict(ph='C', name=key, pid=pid, ts=ts,
+                          args={key: args[key]}))
+    out.write('\n]}\n')
+    return True
+
+
+# (name, sql, numpy dtype or None for text) of each exported column
+EXPORT_COLUMNS = [
+    ('run_id', 'runs.id', 'i8'),
+    ('run_date', 'runs.date', None),
+    ('timings_id', 't.id', 'i8'),
+    ('backend', 't.backend', None),
+    ('batch', 't.batch', None),
+    ('count', 't.count', 'i8'),
+    ('parallelism', 't.parallelism', 'f8'),
+    ('driver', 't.driver', None),
+    ('image', 't.image', None),
+    ('offered_rate', 't.offered_rate', 'f8'),
+    ('status', 't.status', None),
+    ('rec_id', 'r.id', 'i8'),
+    ('cmd', 'r.cmd', None),
+    ('started', 'r.started', 'f8'),
+    ('duration', 'r.duration', 'f8'),
+    ('queue_delay', 'r.queue_delay', 'f8'),
+]
+EXPORT_CHUNK = 10000
+
+
+def export_filter(runs=None, backends=None, batches=None):
+    where = []
+    params = []
+    for col, values in [('runs.id', runs), ('t.backend', backends),
+                        ('t.batch', batches)]:
+        if values:
+            where.append("{} IN ({})".format(col,
+                                             ','.join('?' * len(values))))
+            params.extend(values)
+    sql = ("FROM recs r JOIN timings t ON r.timings_id = t.id "
+           "JOIN runs ON t.run_id = runs.id")
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    return sql, params
+
+
+def export_chunks(runs=None, backends=None, batches=None):
+    """Yields the joined rows of runs, timings and recs in chunks of at
+    most EXPORT_CHUNK, from a single query."""
+    sql, params = export_filter(runs, backends, batches)
+    cur = db.cursor()
+    cur.execute("SELECT " + ", ".join(c[1] for c in EXPORT_COLUMNS) + " " +
+                sql + " ORDER BY runs.id, t.id, r.id", params)
+    while True:
+        rows = cur.fetchmany(EXPORT_CHUNK)
+        if not rows:
+            break
+        yield rows
+
+
+def export_csv(chunks, out):
+    writer = csvlib.writer(out)
+    writer.writerow([c[0] for c in EXPORT_COLUMNS])
+    for rows in chunks:
+        writer.writerows(rows)
+
+
+def export_jsonl(chunks, out):
+    names = [c[0] for c in EXPORT_COLUMNS]
+    for rows in chunks:
+        for row in rows:
+            out.write(json.dumps(dict(zip(names, row))) + "\n")
+
+
+def export_npz(runs, backends, batches, path):
+    """Writes one array per column into an .npz that np.load reads.
+
+    Text columns become fixed width unicode sized to their longest value
+    and missing numbers become nan (or -1 for ints). Columns are spooled
+    to temporary files a chunk at a time, then copied into the archive
+    behind their .npy headers, so memory use does not grow with the run.
+    """
+    sql, params = export_filter(runs, backends, batches)
+    dbc.execute("SELECT count(*), " +
+                ", ".join("max(length({}))".format(c[1])
+                          for c in EXPORT_COLUMNS) + " " + sql, params)
+    stats = dbc.fetchone()
+    n = stats[0]
+    dtypes = [np.dtype(dt) if dt else np.dtype('U{}'.format(width or 1))
+              for (_, _, dt), width in zip(EXPORT_COLUMNS, stats[1:])]
+    spools = [TemporaryFile() for c in EXPORT_COLUMNS]
+    try:
+        for rows in export_chunks(runs, backends, batches):
+            for i, (col, dtype) in enumerate(zip(zip(*rows), dtypes)):
+                if dtype.kind == 'U':
+                    col = ['' if v is None else v for v in col]
+                elif dtype.kind == 'i':
+                    col = [-1 if v is None else v for v in col]
+                else:
+                    col = [np.nan if v is None else v for v in col]
+                spools[i].write(np.asarray(col, dtype=dtype).tobytes())
+        with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as zf:
+            for (name, _, _), dtype, spool in zip(EXPORT_COLUMNS, dtypes,
+                                                  spools):
+                spool.seek(0)
+                with zf.open(name + '.npy', 'w', force_zip64=True) as f:
+                    np.lib.format.write_array_header_1_0(
+                        f, {'descr': np.lib.format.dtype_to_descr(dtype),
+                            'fortran_order': False, 'shape': (n, )})
+                    shutil.copyfileobj(spool, f)
+    finally:
+        for spool in spools:
+            spool.close()
+    return n
 
 
 def show_runs():
@@ -505,8 +3398,11 @@ def show_runs():
 
 def init_db():
     global db, dbc
-    db = sqlite3.connect("bench.db")
+    # backends running in parallel share the file, so wait out their locks
+    db = sqlite3.connect("bench.db", timeout=60)
     dbc = db.cursor()
+    dbc.execute("PRAGMA journal_mode=WAL")
+    dbc.execute("PRAGMA synchronous=NORMAL")
 
     dbc.execute("CREATE TABLE if not exists runs "
                 "(id integer primary key, argv text, date date, message text)")
@@ -519,6 +3415,76 @@ def init_db():
     dbc.execute("CREATE TABLE if not exists recs "
                 "(id integer primary key, cmd text, duration real, "
                 " timings_id int) ")
+    dbc.execute("CREATE TABLE if not exists samples "
+                "(id integer primary key, timings_id int, t real, "
+                "mem_free int, mem_cached int, load real, cpu_busy real, "
+                "disk_avail int)")
+    dbc.execute("CREATE TABLE if not exists proc_samples "
+                "(id integer primary key, timings_id int, t real, "
+                "role text, pid int, rss int, cpu_time real, threads int, "
+                "fds int)")
+    dbc.execute("CREATE TABLE if not exists progress "
+                "(run_id int, backend text, count int, phase text, "
+                "status text, date date, "
+                "primary key (run_id, backend, count, phase))")
+    dbc.execute("CREATE TABLE if not exists daemon_events "
+                "(id integer primary key, run_id int, backend text, "
+                "event text, duration real, date date)")
+    dbc.execute("CREATE TABLE if not exists io_results "
+                "(id integer primary key, run_id int, backend text, "
+                "count int, batch text, workload text, target text, "
+                "bytes int, ios int, runtime real, mb_per_sec real, "
+                "iops real, lat_mean real, lat_p99 real, source text)")
+    dbc.execute("CREATE TABLE if not exists capacity_steps "
+                "(id integer primary key, run_id int, backend text, "
+                "count int, step int, p95 real, mem_avail int, load real, "
+                "violated text)")
+    dbc.execute("CREATE TABLE if not exists capacity "
+                "(id integer primary key, run_id int, backend text, "
+                "max_count int, limit_by text, ceiling int, p95 real, "
+                "mem_avail int, load real, date date)")
+    dbc.execute("CREATE TABLE if not exists footprints "
+                "(id integer primary key, run_id int, backend text, "
+                "count int, batch text, targets int, cgroups int, mem int, "
+                "cpu_time real, io_bytes int, disk int)")
+    dbc.execute("CREATE TABLE if not exists probes "
+                "(id integer primary key, timings_id int, t real, "
+                "query text, duration real, containers int, ok int)")
+    dbc.execute("CREATE TABLE if not exists spans "
+                "(id integer primary key, run_id int, backend text, "
+                "name text, cat text, thread text, start real, dur real, "
+                "args text)")
+    add_columns('runs', [('scenario', 'text')])
+    add_columns('timings', [('parallelism', 'int'),
+                            ('ops_per_sec', 'real'),
+                            ('driver', 'text'),
+                            ('lxd_rss_increase', 'int'),
+                            ('lxd_cpu_time', 'real'),
+                            ('helpers_rss', 'int'),
+                            ('status', 'text'),
+                            ('offered_rate', 'real'),
+                            ('scheduled_rate', 'real'),
+                            ('hist', 'blob')])
+    add_columns('recs', [('started', 'real'),
+                         ('queue_delay', 'real')])
+    dbc.execute("CREATE INDEX if not exists timings_run_id "
+                "ON timings(run_id)")
+    dbc.execute("CREATE INDEX if not exists spans_run_id "
+                "ON spans(run_id)")
+    for table in ['recs', 'samples', 'proc_samples']:
+        dbc.execute("CREATE INDEX if not exists {0}_timings_id "
+                    "ON {0}(timings_id)".format(table))
+
+
+# columns added after the original schema go through here so that
+# existing bench.db files pick them up too.
+def add_columns(table, columns):
+    dbc.execute("PRAGMA table_info({})".format(table))
+    existing = [row[1] for row in dbc.fetchall()]
+    for name, decl in columns:
+        if name not in existing:
+            dbc.execute("ALTER TABLE {} ADD COLUMN {} {}".format(table, name,
+                                                                 decl))
 
 
 if __name__ == "__main__":
@@ -528,31 +3494,143 @@ if __name__ == "__main__":
     sps = p.add_subparsers(dest="subcommand_name",
                            help='sub-command help???')
 
-    run_p = sps.add_parser('run', help='run a bench help')
-    run_p.add_argument("counts",
+    # options of everything that brings up backends: run and capacity
+    backend_p = ArgumentParser(add_help=False)
+    backend_p.add_argument("--image", default='ubuntu',
+                           help="image to use - one of 'ubuntu', 'busybox', "
+                           "or a filename of an exported image tarball")
+    backend_p.add_argument("-m", dest='message', default="",
+                           help="message about run")
+    backend_p.add_argument("--keep", default=False, action="store_true",
+                           help="do not tear down lxd dirs")
+    backend_p.add_argument("--blockdev", default='loop',
+                           help="block device to use for storage backends")
+    backend_p.add_argument("--mem-threshold", dest="mem_threshold",
+                           default=512, type=int,
+                           help="Stop a trial before we have less than this "
+                           "much free + cached RAM in MB")
+    backend_p.add_argument("--runtime-threshold", dest="duration_threshold",
+                           default=600, type=int,
+                           help="Stop a trial after this many seconds")
+    backend_p.add_argument('--dir', dest='run_dir', default="/tmp/",
+                           help="base directory to store temp per-backend "
+                           "lxd dirs.")
+    backend_p.add_argument("--sample-interval", dest="sample_interval",
+                           default=1.0, type=float,
+                           help="seconds between host resource samples "
+                           "taken during each batch")
+    backend_p.add_argument("-j", "--parallelism", default=1, type=int,
+                           help="number of commands to keep in flight at "
+                           "once within a batch")
+    backend_p.add_argument("--engine", default='thread',
+                           choices=sorted(ENGINES),
+                           help="how concurrent commands are dispatched")
+    backend_p.add_argument("--max-inflight", dest="max_inflight", default=64,
+                           type=int,
+                           help="worker cap for open loop steps, which issue "
+                           "commands at a fixed rate; commands arriving "
+                           "while all workers are busy queue")
+    backend_p.add_argument("--driver", default='cli', choices=sorted(DRIVERS),
+                           help="run measured operations through the lxc "
+                           "client ('cli'), directly against the LXD unix "
+                           "socket ('rest') or against an in-process "
+                           "stand-in for LXD ('simulated')")
+    backend_p.add_argument("--sim-latency", dest="sim_latency",
+                           default="launch=lognormal:1:0.3,"
+                           "copy=lognormal:0.5:0.3,default=exp:0.05",
+                           help="simulated latency per lxc subcommand as "
+                           "op=dist,... where dist is a number of seconds, "
+                           "const:S, uniform:LO:HI, normal:MU:SIGMA, "
+                           "lognormal:MEDIAN:SIGMA or exp:MEAN")
+    backend_p.add_argument("--sim-fail", dest="sim_fail", default=0.0,
+                           type=float,
+                           help="probability that a simulated command fails")
+    backend_p.add_argument("--sim-mem", dest="sim_mem", default=0.0,
+                           type=float,
+                           help="MB of memory each simulated container holds")
+    backend_p.add_argument("--sim-growth", dest="sim_growth", default=0.0,
+                           type=float,
+                           help="fraction simulated latencies grow by per "
+                           "container present")
+    backend_p.add_argument("--sim-slots", dest="sim_slots", default=0,
+                           type=int,
+                           help="requests the simulated daemon serves at "
+                           "once, 0 for no limit")
+    backend_p.add_argument("--sim-seed", dest="sim_seed", default=0, type=int,
+                           help="random seed of the simulated driver")
+    backend_p.add_argument("--overhead-samples", dest="overhead_samples",
+                           default=50, type=int,
+                           help="no-op commands timed per backend to measure "
+                           "the harness's own per-op overhead, 0 to skip")
+    backend_p.add_argument("--probe-interval", dest="probe_interval",
+                           default=0.0, type=float,
+                           help="seconds between the list and info queries "
+                           "timed in the background of launch and copy "
+                           "batches, 0 to not probe")
+    backend_p.add_argument("--ready-timeout", dest="ready_timeout",
+                           default=300, type=float,
+                           help="seconds a container may take to become "
+                           "ready after it is started")
+    backend_p.add_argument("--no-recs", dest="keep_recs",
+                           action='store_false',
+                           help="do not store a recs row per command, only "
+                           "each batch's latency histogram, nor the per "
+                           "command trace spans. scaling and knee need "
+                           "recs, and trace then shows no commands")
+
+    run_p = sps.add_parser('run', parents=[backend_p],
+                           help='run a bench help')
+    run_p.add_argument("counts", nargs='?', default=None,
                        help="comma separated list of counts of"
-                       " containers/snapshots/copies to bench")
+                       " containers/snapshots/copies to bench. Defaults to "
+                       "the scenario's counts")
     run_p.add_argument("backends",
                        help="a comma separated list of backends to use.",
                        default="lvm,zfs,dir,btrfs")
-    run_p.add_argument("--image", default='ubuntu',
-                       help="image to use - one of 'ubuntu', 'busybox', or a "
-                       "filename of an exported image tarball")
-    run_p.add_argument("-m", dest='message', default="",
-                       help="message about run")
-    run_p.add_argument("--keep", default=False, action="store_true",
-                       help="do not tear down lxd dirs")
-    run_p.add_argument("--blockdev", default='loop',
-                       help="block device to use for storage backends")
-    run_p.add_argument("--mem-threshold", dest="mem_threshold",
-                       default=512, type=int,
-                       help="Stop a trial before we have less than this much "
-                       "free + cached RAM in MB")
-    run_p.add_argument("--runtime-threshold", dest="duration_threshold",
-                       default=600, type=int,
-                       help="Stop a trial after this many seconds")
-    run_p.add_argument('--dir', dest='run_dir', default="/tmp/",
-                       help="base directory to store temp per-backend lxd dirs.")
+    run_p.add_argument("--scenario", default='default',
+                       help="built-in scenario name or a JSON/TOML "
+                       "scenario file describing the phases to run")
+    run_p.add_argument("--resume", metavar="RUN_ID", default=None,
+                       help="continue an earlier run, skipping the phases "
+                       "it already finished and adding to its results")
+    run_p.add_argument("--on-error", dest="on_error", default='prompt',
+                       choices=['prompt', 'continue', 'abort'],
+                       help="when a phase fails: stop the backend and wait "
+                       "for the user ('prompt'), clean up and go on with "
+                       "the next count ('continue'), or tear down and stop "
+                       "the run ('abort')")
+    run_p.add_argument("--parallel-backends", dest="parallel_backends",
+                       action='store_true',
+                       help="run each backend in its own worker process at "
+                       "the same time instead of one after another")
+    run_p.add_argument("--cpusets", default=None,
+                       help="with --parallel-backends, pin the workers to "
+                       "these cpus, one colon separated group per backend, "
+                       "e.g. '0-3:4-7'")
+    cap_p = sps.add_parser('capacity', parents=[backend_p],
+                           help='find how many containers each backend '
+                           'sustains')
+    cap_p.add_argument("backends",
+                       help="a comma separated list of backends to use.")
+    cap_p.add_argument("--slo-p95", dest="slo_p95", default=30.0,
+                       type=float,
+                       help="highest acceptable p95 launch latency of a "
+                       "ramp step, in seconds")
+    cap_p.add_argument("--slo-mem", dest="slo_mem", default=1024, type=int,
+                       help="lowest acceptable free + cached memory in MB")
+    cap_p.add_argument("--slo-load", dest="slo_load",
+                       default=2.0 * os.cpu_count(), type=float,
+                       help="highest acceptable 1 minute load average")
+    cap_p.add_argument("--step", default=8, type=int,
+                       help="containers launched by the first ramp step")
+    cap_p.add_argument("--min-step", dest="min_step", default=1, type=int,
+                       help="stop bisecting once the gap between the last "
+                       "good and first bad count is this small")
+    cap_p.add_argument("--max-count", dest="max_count", default=1000,
+                       type=int, help="never go beyond this many containers")
+    cap_p.add_argument("--settle", default=5.0, type=float,
+                       help="seconds to wait after each step before "
+                       "checking memory and load")
     show_p = sps.add_parser('show', help='show runs')
     show_p.add_argument("--run", dest="run_id", help="id to show",
                         default=None)
@@ -560,7 +3638,87 @@ if __name__ == "__main__":
                         help="Show results as csv")
     show_p.add_argument("-a", action='store_true',
                         dest='showall', help="show all recs")
+    show_p.add_argument("--stats", action='store_true',
+                        help="show latency percentiles, stddev and bootstrap "
+                        "confidence intervals per batch")
+    show_p.add_argument("--bootstrap", dest="nboot", default=1000, type=int,
+                        help="number of bootstrap resamples for --stats")
+    show_p.add_argument("--confidence", default=0.95, type=float,
+                        help="confidence level of the --stats intervals")
+    show_p.add_argument("--subtract-overhead", dest="subtract_overhead",
+                        action='store_true',
+                        help="take the measured harness overhead off every "
+                        "duration in --stats")
+    show_p.add_argument("--from-hist", dest="from_hist", action='store_true',
+                        help="compute --stats from the batch histograms "
+                        "even where recs were stored")
+    show_p.add_argument("--percentiles", default=None,
+                        help="comma separated percentiles to report from "
+                        "the batch histograms, merged over repeated batches; "
+                        "--run may then list several runs")
+    cmp_p = sps.add_parser('compare', help='compare two runs batch by batch')
+    cmp_p.add_argument("run_a", help="baseline run id")
+    cmp_p.add_argument("run_b", help="run id to check against the baseline")
+    cmp_p.add_argument("--stat", default='median',
+                       choices=sorted(COMPARE_STATS),
+                       help="statistic to report the relative change of")
+    cmp_p.add_argument("--alpha", default=0.05, type=float,
+                       help="significance level of the Mann-Whitney test")
+    cmp_p.add_argument("--threshold", default=0.05, type=float,
+                       help="smallest relative slowdown (0.05 = 5%%) that "
+                       "counts as a regression")
+    cmp_p.add_argument("--bootstrap", dest="nboot", default=1000, type=int,
+                       help="number of bootstrap resamples")
+    cmp_p.add_argument("--confidence", default=0.95, type=float,
+                       help="confidence level of the change interval")
+    cmp_p.add_argument("--csv", action='store_true',
+                       help="Show results as csv")
+    cmp_p.add_argument("--from-hist", dest="from_hist", action='store_true',
+                       help="compare the batch histograms instead of the "
+                       "recs")
+    scale_p = sps.add_parser('scaling',
+                             help='fit latency growth against container '
+                             'density')
+    scale_p.add_argument("run_id", help="run id to analyse")
+    scale_p.add_argument("--alpha", default=0.05, type=float,
+                         help="significance level for the slope tests")
+    scale_p.add_argument("--degrade", default=0.25, type=float,
+                         help="flag batches whose latency grows by more "
+                         "than this fraction (0.25 = 25%%) over the range")
+    scale_p.add_argument("--csv", action='store_true',
+                         help="Show results as csv")
+    knee_p = sps.add_parser('knee',
+                            help='find the throughput knee of open loop '
+                            'rate sweeps')
+    knee_p.add_argument("run_id", help="run id to analyse")
+    knee_p.add_argument("--saturation", default=0.9, type=float,
+                        help="fraction of the offered rate a batch must "
+                        "achieve to count as keeping up")
+    knee_p.add_argument("--csv", action='store_true',
+                        help="Show results as csv")
+    export_p = sps.add_parser('export',
+                              help='stream recs with their batch and run '
+                              'as csv, json lines or numpy .npz')
+    export_p.add_argument("--format", default='csv',
+                          choices=['csv', 'jsonl', 'npz'],
+                          help="output format")
+    export_p.add_argument("--run", dest="runs", default=None,
+                          help="comma separated run ids to export, "
+                          "default all")
+    export_p.add_argument("--backend", dest="backends", default=None,
+                          help="comma separated backends to export")
+    export_p.add_argument("--batch", dest="batches", default=None,
+                          help="comma separated batches to export")
+    export_p.add_argument("-o", dest="output", default=None,
+                          help="file to write, default stdout (required "
+                          "for npz)")
+    trace_p = sps.add_parser('trace',
+                             help='export a run as Chrome trace events')
+    trace_p.add_argument("run_id", help="run id to export")
+    trace_p.add_argument("-o", dest="output", default=None,
+                         help="file to write, default stdout")
     opts = p.parse_args(sys.argv[1:])
+    trace_per_op = getattr(opts, 'keep_recs', True)
 
     init_db()
 
@@ -569,15 +3727,60 @@ if __name__ == "__main__":
         signal.signal(signal.SIGUSR1, handle_sigusr1)
         print("Running. Use 'kill -USR1 {}' to stop a "
               "batch".format(os.getpid()))
+        disk_backends = [b for b in opts.backends.split(',')
+                         if b in ('lvm', 'btrfs', 'zfs')]
+        if (opts.parallel_backends and opts.blockdev != 'loop' and
+                opts.driver != 'simulated' and len(disk_backends) > 1):
+            print("{} would all be set up on {} at once; run them one at a "
+                  "time or use loop devices.".format(
+                      ", ".join(disk_backends), opts.blockdev))
+            sys.exit(1)
+        if opts.resume is not None:
+            run_id = int(opts.resume)
+            dbc.execute("SELECT argv, scenario FROM runs WHERE id = ?",
+                        (run_id, ))
+            row = dbc.fetchone()
+            if row is None:
+                print("No run with id {} to resume.".format(run_id))
+                sys.exit(1)
+            print("Resuming run {}, originally {}".format(run_id, row[0]))
+            if row[1] is not None:
+                scenario = json.loads(row[1])
+            else:
+                scenario = DEFAULT_SCENARIO
+        else:
+            scenario = load_scenario(opts.scenario)
+            dbc.execute("INSERT INTO runs(argv, date, message, scenario) "
+                        "VALUES(?, datetime('now'), ?, ?)",
+                        (str(sys.argv[1:]), opts.message,
+                         json.dumps(scenario)))
+            dbc.execute("select max(id) from runs")
+            run_id = dbc.fetchone()[0]
+        if opts.counts is None and 'counts' not in scenario:
+            print("No counts given and the scenario has none.")
+            sys.exit(1)
+
+        try:
+            run_bench(opts, scenario)
+            show_report(run_id)
+        finally:
+            db.commit()
+            db.close()
+
+    elif opts.subcommand_name == 'capacity':
+
+        signal.signal(signal.SIGUSR1, handle_sigusr1)
+        print("Running. Use 'kill -USR1 {}' to stop the "
+              "ramp".format(os.getpid()))
         dbc.execute("INSERT INTO runs(argv, date, message) "
                     "VALUES(?, datetime('now'), ?)",
                     (str(sys.argv[1:]), opts.message))
         dbc.execute("select max(id) from runs")
         run_id = dbc.fetchone()[0]
-
         try:
-            run_bench(opts)
-            show_report(run_id)
+            for backend in opts.backends.split(','):
+                run_capacity(backend, opts)
+            show_capacity(run_id, 'simple')
         finally:
             db.commit()
             db.close()
@@ -585,7 +3788,61 @@ if __name__ == "__main__":
     elif opts.subcommand_name == 'show':
         if opts.run_id is None:
             show_runs()
+        elif opts.percentiles is not None:
+            show_percentiles(opts.run_id.split(','),
+                             [float(p) for p in opts.percentiles.split(',')],
+                             csv=opts.csv)
+        else:
+            show_report(opts.run_id, csv=opts.csv, showall=opts.showall,
+                        stats=opts.stats, nboot=opts.nboot,
+                        confidence=opts.confidence,
+                        subtract_overhead=opts.subtract_overhead,
+                        from_hist=opts.from_hist)
+
+    elif opts.subcommand_name == 'scaling':
+        show_scaling(opts.run_id, alpha=opts.alpha, degrade=opts.degrade,
+                     csv=opts.csv)
+
+    elif opts.subcommand_name == 'knee':
+        show_knee(opts.run_id, saturation=opts.saturation, csv=opts.csv)
+
+    elif opts.subcommand_name == 'compare':
+        regressions = compare_runs(opts.run_a, opts.run_b, stat=opts.stat,
+                                   alpha=opts.alpha,
+                                   threshold=opts.threshold,
+                                   nboot=opts.nboot,
+                                   confidence=opts.confidence, csv=opts.csv,
+                                   from_hist=opts.from_hist)
+        if regressions:
+            print("{} significant regression(s)".format(regressions))
+            sys.exit(1)
+
+    elif opts.subcommand_name == 'export':
+        def split(arg):
+            return arg.split(',') if arg else None
+        filters = dict(runs=split(opts.runs), backends=split(opts.backends),
+                       batches=split(opts.batches))
+        if opts.format == 'npz':
+            if opts.output is None:
+                print("npz export needs -o FILE")
+                sys.exit(1)
+            n = export_npz(path=opts.output, **filters)
+            print("wrote {} recs to {}".format(n, opts.output))
         else:
-            show_report(opts.run_id, csv=opts.csv, showall=opts.showall)
+            write = export_csv if opts.format == 'csv' else export_jsonl
+            if opts.output is None:
+                write(export_chunks(**filters), sys.stdout)
+                # nothing else may go to stdout with the export
+                sys.exit(0)
+            with open(opts.output, 'w', newline='') as out:
+                write(export_chunks(**filters), out)
+
+    elif opts.subcommand_name == 'trace':
+        if opts.output is None:
+            # nothing else may go to stdout with the trace
+            sys.exit(0 if export_trace(opts.run_id, sys.stdout) else 1)
+        with open(opts.output, 'w') as out:
+            if not export_trace(opts.run_id, out):
+                sys.exit(1)
 
     print("Done, OK")